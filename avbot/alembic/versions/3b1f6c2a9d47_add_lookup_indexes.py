@@ -0,0 +1,70 @@
+"""Add lookup indexes
+
+Revision ID: 3b1f6c2a9d47
+Revises: fbaa15bf9c2e
+Create Date: 2026-10-18 12:00:00.000000
+
+Run with `-x concurrently=1` to build indexes without locking writes
+on a live database.
+
+"""
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6c2a9d47'
+down_revision = 'fbaa15bf9c2e'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_user_telegram_id', 'user', ['telegram_id'], True),
+    ('ix_search_query_user_id', 'search_query', ['user_id'], False),
+    ('ix_inline_query_search_query_id', 'inline_query',
+     ['search_query_id'], False),
+]
+
+
+def is_concurrently():
+    return context.get_x_argument(as_dictionary=True)\
+        .get('concurrently') in ('1', 'true')
+
+
+def merge_duplicate_users():
+    op.execute("""
+        UPDATE search_query SET user_id = d.keep_id
+        FROM (
+            SELECT id, min(id) OVER (PARTITION BY telegram_id) AS keep_id
+            FROM "user"
+        ) d
+        WHERE search_query.user_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM "user" u USING "user" k
+        WHERE u.telegram_id = k.telegram_id AND u.id > k.id
+    """)
+
+
+def upgrade():
+    merge_duplicate_users()
+    if is_concurrently():
+        with op.get_context().autocommit_block():
+            for name, table, columns, unique in INDEXES:
+                op.create_index(
+                    name, table, columns, unique=unique,
+                    postgresql_concurrently=True,
+                )
+    else:
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    if is_concurrently():
+        with op.get_context().autocommit_block():
+            for name, table, _, _ in reversed(INDEXES):
+                op.drop_index(
+                    name, table_name=table, postgresql_concurrently=True)
+    else:
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,147 @@
+"""Partition search_query and inline_query by created_at
+
+Revision ID: 8e4d2b7c1a90
+Revises: 3b1f6c2a9d47
+Create Date: 2026-10-18 14:00:00.000000
+
+Tables are rebuilt as monthly range partitions, the primary keys include
+created_at, so inline_query no longer has a foreign key to search_query.
+Each partition gets its own index of the primary key, a lookup by id alone
+probes all of them, so search queries are looked up with a month hint.
+
+"""
+from datetime import datetime
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4d2b7c1a90'
+down_revision = '3b1f6c2a9d47'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def add_months(dt, months):
+    month = dt.month - 1 + months
+    return datetime(dt.year + month // 12, month % 12 + 1, 1)
+
+
+def create_month_partitions(table):
+    since = None
+    if not context.is_offline_mode():
+        since = op.get_bind().execute(
+            sa.text(f"SELECT min(created_at) FROM {table}_old")
+        ).scalar()
+    since = since or datetime.utcnow()
+    since = datetime(since.year, since.month, 1)
+    until = add_months(datetime.utcnow(), MONTHS_AHEAD + 1)
+    while since < until:
+        next_month = add_months(since, 1)
+        op.execute(
+            f"CREATE TABLE {table}_p{since:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{since.isoformat()}') "
+            f"TO ('{next_month.isoformat()}')"
+        )
+        since = next_month
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def rename_with_suffix(table, indexes, suffix):
+    op.rename_table(table, f"{table}_{suffix}")
+    op.execute(
+        f"ALTER TABLE {table}_{suffix} "
+        f"RENAME CONSTRAINT {table}_pkey TO {table}_{suffix}_pkey"
+    )
+    for index in indexes:
+        op.execute(f"ALTER INDEX {index} RENAME TO {index}_{suffix}")
+
+
+def upgrade():
+    rename_with_suffix("inline_query", ["ix_inline_query_search_query_id"], "old")
+    rename_with_suffix("search_query", ["ix_search_query_user_id"], "old")
+
+    op.execute("""
+        CREATE TABLE search_query (
+            id integer NOT NULL DEFAULT nextval('search_query_id_seq'),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            query_text varchar,
+            num_type varchar(32) NOT NULL,
+            created_at timestamp NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.create_index('ix_search_query_user_id', 'search_query', ['user_id'])
+    create_month_partitions("search_query")
+    op.execute("""
+        INSERT INTO search_query
+        SELECT id, user_id, query_text, num_type,
+               COALESCE(created_at, 'epoch')
+        FROM search_query_old
+    """)
+    op.execute("ALTER SEQUENCE search_query_id_seq OWNED BY search_query.id")
+
+    op.execute("""
+        CREATE TABLE inline_query (
+            id integer NOT NULL DEFAULT nextval('inline_query_id_seq'),
+            search_query_id integer NOT NULL,
+            query varchar,
+            created_at timestamp NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.create_index(
+        'ix_inline_query_search_query_id', 'inline_query', ['search_query_id'])
+    create_month_partitions("inline_query")
+    op.execute("""
+        INSERT INTO inline_query
+        SELECT id, search_query_id, query, COALESCE(created_at, 'epoch')
+        FROM inline_query_old
+    """)
+    op.execute("ALTER SEQUENCE inline_query_id_seq OWNED BY inline_query.id")
+
+    op.drop_table('inline_query_old')
+    op.drop_table('search_query_old')
+
+
+def downgrade():
+    rename_with_suffix("inline_query", ["ix_inline_query_search_query_id"], "part")
+    rename_with_suffix("search_query", ["ix_search_query_user_id"], "part")
+
+    op.execute("""
+        CREATE TABLE search_query (
+            id integer NOT NULL DEFAULT nextval('search_query_id_seq')
+                PRIMARY KEY,
+            user_id integer NOT NULL REFERENCES "user" (id),
+            query_text varchar,
+            num_type varchar(32) NOT NULL,
+            created_at timestamp
+        )
+    """)
+    op.execute("INSERT INTO search_query SELECT * FROM search_query_part")
+    op.execute("ALTER SEQUENCE search_query_id_seq OWNED BY search_query.id")
+    op.create_index('ix_search_query_user_id', 'search_query', ['user_id'])
+
+    op.execute("""
+        CREATE TABLE inline_query (
+            id integer NOT NULL DEFAULT nextval('inline_query_id_seq')
+                PRIMARY KEY,
+            search_query_id integer NOT NULL
+                REFERENCES search_query (id),
+            query varchar,
+            created_at timestamp
+        )
+    """)
+    op.execute("""
+        INSERT INTO inline_query SELECT * FROM inline_query_part
+        WHERE search_query_id IN (SELECT id FROM search_query)
+    """)
+    op.execute("ALTER SEQUENCE inline_query_id_seq OWNED BY inline_query.id")
+    op.create_index(
+        'ix_inline_query_search_query_id', 'inline_query', ['search_query_id'])
+
+    op.drop_table('inline_query_part')
+    op.drop_table('search_query_part')
@@ -1,18 +1,57 @@
+import asyncio
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import date
+from datetime import date, datetime
+from functools import partial
+from html.parser import HTMLParser
 from io import BytesIO
 from typing import List, Union
 
 import cloudscraper
 from requests import Request
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from dateutil.parser import parse
 
-scraper = cloudscraper.create_scraper()
+from avbot import metrics, settings, tracing
+from avbot.photo_cache import PhotoCache
+from avbot.upstream import Upstream
+
 logger = logging.getLogger(__name__)
 
+
+def create_scraper(pool_maxsize):
+    session = cloudscraper.create_scraper()
+    # keep cloudscraper's cipher suite adapter, only resize its pool
+    adapter = session.get_adapter("https://")
+    adapter._pool_connections = settings.AN_POOL_CONNECTIONS
+    adapter._pool_maxsize = pool_maxsize
+    adapter.init_poolmanager(settings.AN_POOL_CONNECTIONS, pool_maxsize)
+    session.mount("http://", HTTPAdapter(
+        pool_connections=settings.AN_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize,
+    ))
+    return session
+
+
+scraper = create_scraper(settings.AN_POOL_MAXSIZE)
+photo_scraper = create_scraper(settings.AN_PHOTO_POOL_MAXSIZE)
+executor = ThreadPoolExecutor(
+    max_workers=settings.AN_POOL_MAXSIZE + settings.AN_PHOTO_POOL_MAXSIZE,
+    thread_name_prefix="avtonomer",
+)
+TIMEOUT = (settings.AN_CONNECT_TIMEOUT, settings.AN_READ_TIMEOUT)
+upstream = Upstream("an", settings.AN_RATE_LIMIT, settings.AN_RATE_BURST)
+photo_upstream = Upstream(
+    "an-photo", settings.AN_PHOTO_RATE_LIMIT, settings.AN_PHOTO_RATE_BURST)
+photo_cache = (
+    PhotoCache(settings.PHOTO_CACHE_DIR, settings.PHOTO_CACHE_MAX_SIZE)
+    if settings.PHOTO_CACHE_DIR
+    else None
+)
+
 CTYPE_RU_CARS = 1
 CTYPE_RU_TRAILERS = 2
 CTYPE_RU_SPECIAL_VEHICLES = 3
@@ -27,6 +66,7 @@ CTYPE_SU_PRIVATE_VEHICLES_1980 = 2
 CTYPE_UA_REGULAR_PLATES_2004 = 1
 TAG_NEW_LETTER_COMBINATION = 13
 AN_BASE_URL = "https://platesmania.com"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 RU_REGIONS_ID = {
@@ -214,14 +254,29 @@ def ensure_https(url):
     return url
 
 
-def parse_search_results(resp) -> Union[AvSearchResult, None]:
-    resp.raise_for_status()
-    res = re.search(r"License plates found.*?<b>([\d\s\.]+)", resp.text)
-    if not res:
-        return None
-    total_results = int(res.group(1).replace(".", ""))
+def parse_date(text):
+    text = text.strip()
+    try:
+        return datetime.strptime(text, DATE_FORMAT)
+    except ValueError:
+        return parse(text)
+
 
-    doc = BeautifulSoup(resp.text, "html.parser")
+def make_car(page_href, model_text, thumb_src, license_plate, date_text):
+    page_url = "{}{}".format(AN_BASE_URL, page_href)
+    thumb_url = ensure_https(thumb_src)
+    dt = parse_date(date_text)
+    model_arr = model_text.split(" ", maxsplit=1)
+    if len(model_arr) == 2:
+        make, model = model_arr
+    else:
+        make = model_arr[0]
+        model = ""
+    return AvCar(make, model, dt, page_url, "", thumb_url, license_plate)
+
+
+def parse_cars_bs4(text) -> List[AvCar]:
+    doc = BeautifulSoup(text, "html.parser")
     panels = doc.select(".content .panel-body")
 
     cars = []
@@ -230,18 +285,141 @@ def parse_search_results(resp) -> Union[AvSearchResult, None]:
         images = panel.select("img")
         if len(links) < 2 or len(images) < 2:
             continue
-        page_url = "{}{}".format(AN_BASE_URL, links[0]["href"])
-        thumb_url = ensure_https(images[0]["src"])
-        license_plate = images[1]["alt"]
-        dt = parse(panel.select("small.pull-right")[0].text)
-        model_arr = links[1].text.split(" ", maxsplit=1)
-        if len(model_arr) == 2:
-            make, model = model_arr
-        else:
-            make = model_arr[0]
-            model = ""
-        cars.append(AvCar(make, model, dt, page_url, "", thumb_url, license_plate))
+        cars.append(make_car(
+            links[0]["href"],
+            links[1].text,
+            images[0]["src"],
+            images[1]["alt"],
+            panel.select("small.pull-right")[0].text,
+        ))
+    return cars
+
+
+def _xpath_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def parse_cars_lxml(text) -> List[AvCar]:
+    import lxml.html
+
+    doc = lxml.html.fromstring(text)
+    panels = doc.xpath(
+        f"//*[{_xpath_class('content')}]//*[{_xpath_class('panel-body')}]"
+    )
+
+    cars = []
+    for panel in panels:
+        links = panel.xpath(".//a")
+        images = panel.xpath(".//img")
+        if len(links) < 2 or len(images) < 2:
+            continue
+        small = panel.xpath(f".//small[{_xpath_class('pull-right')}]")
+        cars.append(make_car(
+            links[0].get("href"),
+            links[1].text_content(),
+            images[0].get("src"),
+            images[1].get("alt"),
+            small[0].text_content(),
+        ))
+    return cars
+
+
+class _PanelsExtractor(HTMLParser):
+    """Collect links, images and dates of .content .panel-body elements
+
+    Only the data parse_cars needs is kept, no document tree is built.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.panels = []
+        self._open = []  # [panel, depth of its div]
+        self._depth = 0
+        self._content_depth = None
+        self._text_targets = []  # [(list, index), tag]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if tag == "div":
+            self._depth += 1
+            if self._content_depth is None and "content" in classes:
+                self._content_depth = self._depth
+            elif self._content_depth is not None and "panel-body" in classes:
+                panel = {"links": [], "link_texts": [], "images": [],
+                         "dates": []}
+                self.panels.append(panel)
+                self._open.append((panel, self._depth))
+        elif tag == "a":
+            for panel, _ in self._open:
+                panel["links"].append(attrs.get("href"))
+                panel["link_texts"].append("")
+                self._text_targets.append(
+                    (panel["link_texts"], len(panel["link_texts"]) - 1, "a"))
+        elif tag == "img":
+            for panel, _ in self._open:
+                panel["images"].append(attrs)
+        elif tag == "small" and "pull-right" in classes:
+            for panel, _ in self._open:
+                panel["dates"].append("")
+                self._text_targets.append(
+                    (panel["dates"], len(panel["dates"]) - 1, "small"))
+
+    def handle_endtag(self, tag):
+        if tag == "div":
+            while self._open and self._open[-1][1] >= self._depth:
+                self._open.pop()
+            if self._content_depth == self._depth:
+                self._content_depth = None
+            self._depth -= 1
+        elif tag in ("a", "small"):
+            self._text_targets = [
+                target for target in self._text_targets
+                if target[2] != tag
+            ]
+
+    def handle_data(self, data):
+        for values, index, _ in self._text_targets:
+            values[index] += data
+
+
+def parse_cars_stream(text) -> List[AvCar]:
+    extractor = _PanelsExtractor()
+    extractor.feed(text)
+    extractor.close()
+
+    cars = []
+    for panel in extractor.panels:
+        links = panel["links"]
+        images = panel["images"]
+        if len(links) < 2 or len(images) < 2:
+            continue
+        cars.append(make_car(
+            links[0],
+            panel["link_texts"][1],
+            images[0]["src"],
+            images[1]["alt"],
+            panel["dates"][0],
+        ))
+    return cars
+
+
+PARSERS = {
+    "bs4": parse_cars_bs4,
+    "lxml": parse_cars_lxml,
+    "stream": parse_cars_stream,
+}
 
+
+def parse_search_results(resp) -> Union[AvSearchResult, None]:
+    resp.raise_for_status()
+    res = re.search(r"License plates found.*?<b>([\d\s\.]+)", resp.text)
+    if not res:
+        return None
+    total_results = int(res.group(1).replace(".", ""))
+    with metrics.PARSE_SECONDS.labels(settings.AN_PARSER).time(), \
+            tracing.span("parse", parser=settings.AN_PARSER):
+        cars = PARSERS[settings.AN_PARSER](resp.text)
     return AvSearchResult(total_results, cars)
 
 
@@ -256,9 +434,11 @@ def search_ru(fastsearch=None, ctype=None, regions=None, tags=None) -> AvSearchR
     if tags is not None:
         for i, tag in enumerate(tags):
             params[f"tags[{i}]"] = tag
-    resp = scraper.get(
+    resp = upstream.get(
+        scraper,
         f"{AN_BASE_URL}/ru/gallery.php",
         params=params,
+        timeout=TIMEOUT,
     )
     return parse_search_results(resp)
 
@@ -267,9 +447,11 @@ def search(gallery, nomer, ctype=None) -> AvSearchResult | None:
     params = {"nomer": nomer}
     if ctype is not None:
         params["ctype"] = ctype
-    resp = scraper.get(
+    resp = upstream.get(
+        scraper,
         f"{AN_BASE_URL}/{gallery}/gallery.php",
         params=params,
+        timeout=TIMEOUT,
     )
     return parse_search_results(resp)
 
@@ -282,9 +464,11 @@ def search_us(nomer=None, region=None, ctype=None) -> AvSearchResult | None:
         params["region"] = region
     if ctype is not None:
         params["ctype"] = ctype
-    resp = scraper.get(
+    resp = upstream.get(
+        scraper,
         f"{AN_BASE_URL}/us/gallery.php",
         params=params,
+        timeout=TIMEOUT,
     )
     return parse_search_results(resp)
 
@@ -303,7 +487,8 @@ def get_series_ru_url(series_number):
 
 
 def get_series_us(region, ctype, series_number):
-    resp = scraper.get(
+    resp = upstream.get(
+        scraper,
         f"{AN_BASE_URL}/us/gallery.php",
         params={
             "gal": "us",
@@ -311,6 +496,7 @@ def get_series_us(region, ctype, series_number):
             "ctype": ctype,
             "nomer": "{} *".format(series_number),
         },
+        timeout=TIMEOUT,
     )
     resp.raise_for_status()
     res = re.search(r"License plates found.*?<b>([\d\s\.]+)", resp.text)
@@ -319,8 +505,35 @@ def get_series_us(region, ctype, series_number):
 
 
 def load_photo(path):
-    resp = scraper.get(path)
+    if photo_cache:
+        fp = photo_cache.open(path)
+        if fp:
+            return fp
+    resp = photo_upstream.get(photo_scraper, path, timeout=TIMEOUT)
     if resp.status_code == 200:
+        if photo_cache:
+            photo_cache.store(path, resp.content)
         return BytesIO(resp.content)
     if resp.status_code != 404:
         resp.raise_for_status()
+
+
+def _run_in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+async def async_search_ru(*args, **kwargs) -> AvSearchResult | None:
+    return await _run_in_executor(search_ru, *args, **kwargs)
+
+
+async def async_search(*args, **kwargs) -> AvSearchResult | None:
+    return await _run_in_executor(search, *args, **kwargs)
+
+
+async def async_search_us(*args, **kwargs) -> AvSearchResult | None:
+    return await _run_in_executor(search_us, *args, **kwargs)
+
+
+async def async_load_photo(path):
+    return await _run_in_executor(load_photo, path)
@@ -0,0 +1,130 @@
+"""Redis-backed Bloom filters of plates known to have no photos
+
+Every num_type has one filter per time generation, older generations
+expire, so plates are rechecked upstream eventually. A generation which
+holds more than capacity items grows a new slice instead of losing
+accuracy. A lookup checks all slices of all generations, so every slice
+gets a share of the error rate: slices of a generation get halving
+shares, which sum up to error_rate / generations.
+
+Plates found to have photos after all are remembered separately until
+their filter entries expire, as bits can't be removed from a filter.
+"""
+import functools
+import hashlib
+import math
+import time
+
+import redis
+
+from avbot import settings
+
+_redis = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL)
+
+
+@functools.lru_cache(maxsize=None)
+def get_filter_size(capacity, error_rate):
+    """Return the number of bits and hash functions for a filter"""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def get_offsets(item, bits, hashes):
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class NegativeIndex:
+
+    def __init__(self, name, capacity, error_rate, period, generations):
+        self.name = name
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.period = period
+        self.generations = generations
+
+    def get_slice_size(self, slice_num):
+        """Return the number of bits and hash functions of a slice"""
+        return get_filter_size(
+            self.capacity,
+            self.error_rate / (2 * self.generations) / 2 ** slice_num,
+        )
+
+    def _generation(self, now=None):
+        return int((now or time.time()) // self.period)
+
+    def _counter_key(self, generation):
+        return f"bloom:{self.name}:{generation}:n"
+
+    def _slice_key(self, generation, slice_num):
+        return f"bloom:{self.name}:{generation}:{slice_num}"
+
+    def _found_key(self, item):
+        return f"bloom:{self.name}:found:{item}"
+
+    def add(self, item):
+        generation = self._generation()
+        ttl = self.period * self.generations
+        count = _redis.incr(self._counter_key(generation))
+        slice_num = (count - 1) // self.capacity
+        slice_key = self._slice_key(generation, slice_num)
+        pipe = _redis.pipeline(transaction=False)
+        for offset in get_offsets(item, *self.get_slice_size(slice_num)):
+            pipe.setbit(slice_key, offset, 1)
+        pipe.expire(slice_key, ttl)
+        pipe.expire(self._counter_key(generation), ttl)
+        pipe.delete(self._found_key(item))
+        pipe.execute()
+
+    def discard(self, item):
+        """Stop reporting item until it is added again"""
+        _redis.setex(
+            self._found_key(item), self.period * self.generations, 1)
+
+    def __contains__(self, item):
+        current = self._generation()
+        generations = [current - i for i in range(self.generations)]
+        *counts, found = _redis.mget(
+            [self._counter_key(g) for g in generations]
+            + [self._found_key(item)])
+        if found:
+            return False
+        slices = [
+            (self._slice_key(g, slice_num), slice_num)
+            for g, count in zip(generations, counts) if count
+            for slice_num in range((int(count) - 1) // self.capacity + 1)
+        ]
+        if not slices:
+            return False
+        pipe = _redis.pipeline(transaction=False)
+        sizes = []
+        for slice_key, slice_num in slices:
+            offsets = get_offsets(item, *self.get_slice_size(slice_num))
+            for offset in offsets:
+                pipe.getbit(slice_key, offset)
+            sizes.append(len(offsets))
+        bits = pipe.execute()
+        start = 0
+        for size in sizes:
+            if all(bits[start:start + size]):
+                return True
+            start += size
+        return False
+
+
+_indexes = {}
+
+
+def get_negative_index(num_type):
+    if num_type not in _indexes:
+        _indexes[num_type] = NegativeIndex(
+            num_type,
+            settings.EMPTY_PLATES_CAPACITY,
+            settings.EMPTY_PLATES_ERROR_RATE,
+            settings.EMPTY_PLATES_PERIOD,
+            settings.EMPTY_PLATES_GENERATIONS,
+        )
+    return _indexes[num_type]
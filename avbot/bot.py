@@ -1,19 +1,39 @@
 import logging
-from telegram.ext import Updater
+from queue import Queue
 
-from avbot import settings
+from telegram.ext import ExtBot, Updater
+from telegram.utils.request import Request
+
+from avbot import db, metrics, profiling, settings, tasks
 from avbot.commands import register_commands
+from avbot.dispatcher import ShardedDispatcher
 
 logger = logging.getLogger(__name__)
-updater = Updater(
+bot = ExtBot(
     token=settings.BOT_TOKEN,
-    request_kwargs=settings.REQUEST_KWARGS,
+    request=Request(
+        # every shard and run_async worker may use a connection
+        con_pool_size=settings.BOT_SHARDS + settings.BOT_WORKERS + 4,
+        **(settings.REQUEST_KWARGS or {}),
+    ),
+)
+dispatcher = ShardedDispatcher(
+    bot, Queue(),
+    shards=settings.BOT_SHARDS,
+    workers=settings.BOT_WORKERS,
     use_context=True,
 )
+updater = Updater(dispatcher=dispatcher, workers=None)
 
 
 def main():
     register_commands(updater.dispatcher)
+    if settings.METRICS_PORT:
+        metrics.start_server(settings.METRICS_PORT)
+    if settings.DB_WRITE_BEHIND:
+        flusher_stop, flusher = db.start_flusher()
+    if tasks.local_runner is not None:
+        tasks.local_runner.schedule_periodic(tasks.app)
     if settings.WEBHOOK_URL:
         updater.start_webhook(
             listen=settings.WEBHOOK_HOST,
@@ -29,6 +49,12 @@ def main():
         updater.start_polling(timeout=10)
         logger.info("started")
     updater.idle()
+    if tasks.local_runner is not None:
+        tasks.sender.flush(timeout=tasks.TASKS_TIME_LIMIT)
+    if settings.DB_WRITE_BEHIND:
+        flusher_stop.set()
+        flusher.join()
+    profiling.store.flush()
 
 
 if __name__ == "__main__":
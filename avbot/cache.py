@@ -1,41 +1,404 @@
+from collections import OrderedDict
+from datetime import timedelta
 from functools import wraps
+import logging
+import os
 import pickle
+import re
+import threading
+import time as _time
+import uuid
 import redis
 
-from avbot import settings
+from avbot import codec, metrics, settings, tracing
+
+SINGLE_FLIGHT_POLL_INTERVAL = 0.1
+INVALIDATION_CHANNEL = "avbot:cache:invalidate"
+
+logger = logging.getLogger(__name__)
 
 _cache = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL)
 
 
-def add(key, value, time=None):
-    key = pickle.dumps(key)
-    serialized_value = pickle.dumps(value)
+def _key(key):
+    if isinstance(key, str):
+        return b"k:" + key.encode("utf-8")
+    return pickle.dumps(key)
+
+
+def _dumps(value):
+    return codec.dumps(
+        value, settings.CACHE_COMPRESS, settings.CACHE_COMPRESS_MIN_SIZE)
+
+
+def _fresh_key(key):
+    return b"fresh:" + key
+
+
+def add(key, value, time=None, stale_time=None):
+    """Store value, with stale_time it is served stale after that time
+
+    The entry itself lives until time expires, a separate marker tells
+    whether it is still fresh.
+    """
+    key = _key(key)
+    serialized_value = _dumps(value)
+    pipe = _cache.pipeline()
     if time:
-        _cache.setex(key, time, serialized_value)
+        pipe.setex(key, time, serialized_value)
     else:
-        _cache.set(key, serialized_value)
+        pipe.set(key, serialized_value)
+    if stale_time:
+        pipe.setex(_fresh_key(key), stale_time, 1)
+    if _local is not None:
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+    pipe.execute()
+    _local_set(key, value, time)
+    return value
+
+
+def get(key, revalidate=None):
+    """Return cached value of key or None
+
+    If revalidate is given and the value is stale, it is still returned,
+    and revalidate is called by exactly one of the concurrent readers to
+    refresh the value in background.
+    """
+    key = _key(key)
+    with tracing.span("cache", family=_get_family(key)):
+        return _get(key, revalidate)
+
+
+def _get(key, revalidate):
+    value = _local_get(key)
+    if value is not None:
+        return value
+    is_stale = False
+    if revalidate is None:
+        cached_value = _cache.get(key)
+    else:
+        pipe = _cache.pipeline()
+        pipe.get(key)
+        pipe.exists(_fresh_key(key))
+        cached_value, is_fresh = pipe.execute()
+        is_stale = bool(cached_value) and not is_fresh
+        # the marker makes other readers serve the stale value without
+        # revalidating it again
+        if is_stale and _cache.set(
+            _fresh_key(key), 1, nx=True,
+            ex=settings.CACHE_REVALIDATE_TIMEOUT,
+        ):
+            revalidate()
+    value = codec.loads(cached_value) if cached_value else None
+    _count("redis", key, value is not None)
+    if value is not None and not is_stale:
+        _local_set(key, value)
+    return value
+
+
+def get_many(keys):
+    """Return cached values of keys (None for missing) in one round-trip"""
+    if not keys:
+        return []
+    keys = [_key(key) for key in keys]
+    values = [_local_get(key) for key in keys]
+    missing = [i for i, value in enumerate(values) if value is None]
+    if missing:
+        cached_values = _cache.mget([keys[i] for i in missing])
+        for i, cached_value in zip(missing, cached_values):
+            value = codec.loads(cached_value) if cached_value else None
+            _count("redis", keys[i], value is not None)
+            values[i] = value
+    return values
+
+
+def set_many(items, time=None):
+    """Store all key/value pairs of items in one round-trip"""
+    if not items:
+        return
+    pipe = _cache.pipeline(transaction=False)
+    for key, value in items.items():
+        key = _key(key)
+        if time:
+            pipe.setex(key, time, _dumps(value))
+        else:
+            pipe.set(key, _dumps(value))
+        if _local is not None:
+            pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+    pipe.execute()
+    for key, value in items.items():
+        _local_set(_key(key), value, time)
+
+
+def delete(key):
+    """Delete key, also from local caches of all processes"""
+    key = _key(key)
+    if _local is not None:
+        _local.delete(key)
+    if _local is not None or _shared_locals:
+        pipe = _cache.pipeline()
+        pipe.delete(key, _fresh_key(key))
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+        pipe.execute()
+    else:
+        _cache.delete(key, _fresh_key(key))
+
+
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry TTL
+
+    Entries of a shared cache are dropped in all processes when their
+    string keys are deleted with delete().
+    """
+
+    def __init__(self, maxsize, ttl, shared=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if shared:
+            _shared_locals.append(self)
+
+    def get(self, key):
+        if self.shared:
+            _ensure_listener()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < _time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = _time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_shared_locals = []
+_local = (
+    LocalCache(settings.CACHE_LOCAL_SIZE, settings.CACHE_LOCAL_TTL)
+    if settings.CACHE_LOCAL_SIZE
+    else None
+)
+_stats_lock = threading.Lock()
+_stats = {
+    "local_hits": 0,
+    "local_misses": 0,
+    "redis_hits": 0,
+    "redis_misses": 0,
+}
+_listener_lock = threading.Lock()
+_listener_pid = None
+_listener_token = None
+
+
+def _get_family(key):
+    """Return name of the key family, like an_paginated_search"""
+    if not key.startswith(b"k:"):
+        return "func"
+    return re.split(r"[-(:]", key[2:].decode("utf-8"), 1)[0]
+
+
+def _count(tier, key, hit):
+    with _stats_lock:
+        _stats[f"{tier}_hits" if hit else f"{tier}_misses"] += 1
+    metrics.CACHE_REQUESTS.labels(
+        _get_family(key), tier, "hit" if hit else "miss").inc()
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    for tier in ("local", "redis"):
+        total = stats[f"{tier}_hits"] + stats[f"{tier}_misses"]
+        stats[f"{tier}_hit_rate"] = (
+            stats[f"{tier}_hits"] / total if total else 0.0)
+    return stats
+
+
+def _seconds(time):
+    if isinstance(time, timedelta):
+        return time.total_seconds()
+    return time
+
+
+def _local_get(key):
+    if _local is None:
+        return None
+    _ensure_listener()
+    value = _local.get(key)
+    _count("local", key, value is not None)
     return value
 
 
-def get(key):
-    key = pickle.dumps(key)
-    cached_value = _cache.get(key)
-    if cached_value:
-        return pickle.loads(cached_value)
-    return None
+def _local_set(key, value, time=None):
+    if _local is None:
+        return
+    ttl = settings.CACHE_LOCAL_TTL
+    if time is not None and _seconds(time) > 0:
+        ttl = min(ttl, _seconds(time))
+    _local.set(key, value, ttl)
+
+
+def _invalidation_message(key):
+    _ensure_listener()
+    return _listener_token.encode("utf-8") + b"\n" + key
+
+
+def _listen_invalidations(token):
+    while True:
+        try:
+            pubsub = _cache.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                _handle_invalidation(message["data"], token)
+        except redis.exceptions.RedisError:
+            logger.exception("cache invalidation listener failed")
+            # invalidations may have been missed while disconnected
+            _clear_locals()
+            _time.sleep(1)
+
+
+def _handle_invalidation(data, token):
+    sender, _, key = data.partition(b"\n")
+    if sender == token.encode("utf-8"):
+        return
+    if _local is not None:
+        _local.delete(key)
+    if key.startswith(b"k:"):
+        for local_cache in _shared_locals:
+            local_cache.delete(key[2:].decode("utf-8"))
+
+
+def _clear_locals():
+    for local_cache in [_local, *_shared_locals]:
+        if local_cache is not None:
+            local_cache.clear()
 
 
-def cached_func(time):
+def _ensure_listener():
+    """Start the invalidation listener once per process (also after fork)"""
+    global _listener_pid, _listener_token
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        _clear_locals()
+        _listener_token = f"{pid}-{uuid.uuid4().hex}"
+        threading.Thread(
+            target=_listen_invalidations, args=(_listener_token, ),
+            name="cache-invalidation", daemon=True,
+        ).start()
+        _listener_pid = pid
+
+
+def push(key, *values):
+    _cache.rpush(_key(key), *[_dumps(v) for v in values])
+
+
+def push_front(key, *values):
+    """Put values back to the head of the list keeping their order"""
+    _cache.lpush(_key(key), *[_dumps(v) for v in reversed(values)])
+
+
+def pop_list(key, count):
+    """Remove and return first count values of the list atomically"""
+    pipe = _cache.pipeline()
+    pipe.lrange(_key(key), 0, count - 1)
+    pipe.ltrim(_key(key), count, -1)
+    values, _ = pipe.execute()
+    return [codec.loads(v) for v in values]
+
+
+def single_flight(key, func, time=None, stale_time=None, revalidate=None,
+                  lock_timeout=settings.SEARCH_LOCK_TIMEOUT,
+                  wait_timeout=settings.SEARCH_WAIT_TIMEOUT, get_ttl=None):
+    """Return cached value of key or compute it once across all workers
+
+    The worker which takes the lease calls func and stores its result,
+    the others wait until the value appears in the cache. If the lease
+    is released without a value, the waiter tries to take it again.
+    Waiters never call func while the lease is held, they wait at least
+    lock_timeout and return None when waiting takes too long.
+    get_ttl may return (time, stale_time) depending on the value.
+    """
+    value = get(key, revalidate)
+    if value is not None:
+        return value
+    lock = _cache.lock(
+        b"lock:" + _key(key),
+        timeout=lock_timeout,
+    )
+    deadline = _time.monotonic() + max(wait_timeout, lock_timeout)
+    while True:
+        if lock.acquire(blocking=False):
+            try:
+                value = get(key)
+                if value is None:
+                    value = func()
+                    if value is not None:
+                        add(key, value, *(
+                            get_ttl(value) if get_ttl
+                            else (time, stale_time)
+                        ))
+                return value
+            finally:
+                try:
+                    lock.release()
+                except redis.exceptions.LockError:
+                    pass
+        while True:
+            # the value and the lease state in one round-trip
+            cached_value, leased = _cache.mget([_key(key), lock.name])
+            value = codec.loads(cached_value) if cached_value else None
+            if value is not None:
+                return value
+            if _time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting for {key!r}")
+                return None
+            if leased is None:
+                break
+            _time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+def cached_func(time, stale_time=None):
     def actual_decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = pickle.dumps([args, kwargs])
-            cached_value = _cache.get(key)
+            key = [args, kwargs]
+
+            def refresh():
+                value = func(*args, **kwargs)
+                if value is not None:
+                    add(key, value, time, stale_time)
+                return value
+
+            def revalidate():
+                threading.Thread(target=refresh, daemon=True).start()
+
+            cached_value = get(key, revalidate if stale_time else None)
             if cached_value is not None:
-                return pickle.loads(cached_value)
-            value = func(*args, **kwargs)
-            if value is not None:
-                _cache.setex(key, time, pickle.dumps(value))
-            return value
+                return cached_value
+            return refresh()
         return wrapper
     return actual_decorator
@@ -6,10 +6,19 @@ class PlateRequestBase:
     example = None
     description = None
     task = None
+    pattern = None
+    separator = " "
+    normalize = staticmethod(str.lower)
 
     @classmethod
     def validate(cls, query):
-        raise NotImplementedError()
+        return cls.validate_normalized(cls.normalize(query))
+
+    @classmethod
+    def validate_normalized(cls, query):
+        res = cls.pattern.match(query)
+        if res:
+            return cls.separator.join(res.groups())
 
     @classmethod
     def search(cls, validated_query):
@@ -28,19 +37,23 @@ class PlateRequestBase:
         raise NotImplementedError()
 
 
+def make_translation_table(src, dst):
+    return dict([(ord(a), ord(b)) for (a, b) in zip(src, dst)])
+
+
+LATIN_TABLE = make_translation_table(
+    "авекмнорстухАВЕКМНОРСТУХ", "abekmhopctyxabekmhopctyx")
+CYR_TABLE = make_translation_table("iI", "\u0456\u0406")
+CYRILLIC_TABLE = make_translation_table("abekmhopctyx", "АВЕКМНОРСТУХ")
+
+
 def translate_to_latin(text):
-    chars = ("авекмнорстухАВЕКМНОРСТУХ", "abekmhopctyxabekmhopctyx")
-    table = dict([(ord(a), ord(b)) for (a, b) in zip(*chars)])
-    return text.lower().translate(table)
+    return text.lower().translate(LATIN_TABLE)
 
 
 def translate_to_cyr(text):
-    chars = ("iI", "\u0456\u0406")
-    table = dict([(ord(a), ord(b)) for (a, b) in zip(*chars)])
-    return text.lower().translate(table)
+    return text.lower().translate(CYR_TABLE)
 
 
 def translate_to_cyrillic(number):
-    chars = ("abekmhopctyx", "АВЕКМНОРСТУХ")
-    table = dict([(ord(a), ord(b)) for (a, b) in zip(*chars)])
-    return number.translate(table)
+    return number.translate(CYRILLIC_TABLE)
@@ -11,16 +11,10 @@ class GeVehicles2014Request(PlateRequestBase):
     example = "af-235-fa"
     description = __("vehicle plate (2014)")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = query.lower()
-        res = re.match(
-            r"^([a-z]{2})-(\d{3})-([a-z]{2})$",
-            query
-        )
-        if res:
-            return "-".join(res.groups())
+    separator = "-"
+    pattern = re.compile(
+        r"^([a-z]{2})-(\d{3})-([a-z]{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
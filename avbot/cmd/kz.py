@@ -11,16 +11,10 @@ class KzPrivateVehicles2012Request(PlateRequestBase):
     example = "453dxa12"
     description = __("private vehicle plate (2012)")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^(\d{3})\s*([a-z]{3})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^(\d{3})\s*([a-z]{3})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -12,16 +12,10 @@ class RuVehicleRequest(PlateRequestBase):
     example = "а123аа777"
     description = __("vehicle plate 🚗")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{1})\s*(\d{3})\s*([abekmhopctyx]{2})\s*(\d{2,3})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{1})\s*(\d{3})\s*([abekmhopctyx]{2})\s*(\d{2,3})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -33,16 +27,10 @@ class RuTrailersRequest(PlateRequestBase):
     example = "ан239936"
     description = __("trailer plate")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{2})\s*(\d{4})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{2})\s*(\d{4})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -54,16 +42,10 @@ class RuSpecialVehiclesRequest(PlateRequestBase):
     example = "4197хк47"
     description = __("special vehicle plate 🚜")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^(\d{4})\s*([abekmhopctyx]{2})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^(\d{4})\s*([abekmhopctyx]{2})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -75,16 +57,10 @@ class RuMotorcyclesRequest(PlateRequestBase):
     example = "7851аа40"
     description = __("motorcycle plate 🏍")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^(\d{4})\s*([abekmhopctyx]{2})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^(\d{4})\s*([abekmhopctyx]{2})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -96,16 +72,10 @@ class RuTransitRequest(PlateRequestBase):
     example = "нт005х77"
     description = __("transit plate")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{2})\s*(\d{3})\s*([abekmhopctyx]{1})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{2})\s*(\d{3})\s*([abekmhopctyx]{1})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -117,16 +87,10 @@ class RuPublicTransportRequest(PlateRequestBase):
     example = "аа12377"
     description = __("public transport plate 🚌")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{2})\s*(\d{3})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{2})\s*(\d{3})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -138,16 +102,10 @@ class RuPoliceVehiclesRequest(PlateRequestBase):
     example = "с201799"
     description = __("police vehicles plate 🚓")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{1})\s*(\d{4})\s*(\d{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{1})\s*(\d{4})\s*(\d{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -159,10 +117,11 @@ class RuRegionInfoRequest(PlateRequestBase):
     example = "ru37"
     description = __("info about region")
     task = tasks.an_listed_search
+    pattern = re.compile(r"^ru(\d{2,3})$")
 
     @classmethod
-    def validate(cls, query):
-        res = re.match(r"^ru(\d{2,3})$", query.lower())
+    def validate_normalized(cls, query):
+        res = cls.pattern.match(query)
         if res:
             region = res.groups()[0]
             if region in an.RU_REGIONS_ID.keys():
@@ -209,14 +168,14 @@ class RuSeriesInfoRequest(PlateRequestBase):
     example = "ааа777"
     description = __("info about vehicle plate series")
     task = tasks.an_listed_search
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([abekmhopctyx]{1})[\s\*]*([abekmhopctyx]{2})(\d{2,3})$"
+    )
 
     @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([abekmhopctyx]{1})[\s\*]*([abekmhopctyx]{2})(\d{2,3})$",
-            query,
-        )
+    def validate_normalized(cls, query):
+        res = cls.pattern.match(query)
         if res:
             region = res.groups()[2]
             if region in an.RU_REGIONS_ID.keys():
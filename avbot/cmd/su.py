@@ -11,16 +11,10 @@ class SuVehicleRequest(PlateRequestBase):
     example = "а0069МО"
     description = __("private vehicles (1980) 🚗")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_cyr(query)
-        res = re.match(
-            r"^([абвгдежзиклмнопрстуфхцчшщэюя\u0456]{1})\s*(\d{4})\s*([абвгдежзиклмнопрстуфхцчшщэюя\u0456АБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЩЭЮЯ\u0406]{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_cyr)
+    pattern = re.compile(
+        r"^([абвгдежзиклмнопрстуфхцчшщэюя\u0456]{1})\s*(\d{4})\s*([абвгдежзиклмнопрстуфхцчшщэюя\u0456АБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЩЭЮЯ\u0406]{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -11,16 +11,10 @@ class UaPrivateVehiclesRequest(PlateRequestBase):
     example = "aa1234bb"
     description = __("regular plates (2004)")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^([a-z]{2})\s*(\d{4})\s*([a-z]{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^([a-z]{2})\s*(\d{4})\s*([a-z]{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
@@ -22,13 +22,11 @@ class UsSeriesInfoRequest(PlateRequestBase):
     example = "ny xxx"
     description = __("info about state plate series (possible states: ga, pa, oh, nc, ny)")
     task = tasks.an_listed_search
+    pattern = re.compile(r"^([a-z]{2})\s+([a-z]{3})$")
 
     @classmethod
-    def validate(cls, query):
-        res = re.match(
-            r"^([a-z]{2})\s+([a-z]{3})$",
-            query.lower(),
-        )
+    def validate_normalized(cls, query):
+        res = cls.pattern.match(query)
         if res:
             state = res.groups()[0]
             if state in US_STATES_ID.keys():
@@ -11,16 +11,10 @@ class UzPrivateVehiclesRequest(PlateRequestBase):
     example = "01p347ta"
     description = __("private vehicle plate")
     task = tasks.an_paginated_search
-
-    @classmethod
-    def validate(cls, query):
-        query = translate_to_latin(query)
-        res = re.match(
-            r"^(\d{2})\s*([a-z]{1})\s*(\d{3})\s*([a-z]{2})$",
-            query
-        )
-        if res:
-            return " ".join(res.groups())
+    normalize = staticmethod(translate_to_latin)
+    pattern = re.compile(
+        r"^(\d{2})\s*([a-z]{1})\s*(\d{3})\s*([a-z]{2})$"
+    )
 
     @classmethod
     def search(cls, validated_query):
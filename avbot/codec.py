@@ -0,0 +1,126 @@
+"""Compact versioned serialization of cached values
+
+Search results are pickled as plain tuples with well-known URL prefixes
+replaced by an index, which is smaller than pickled dataclasses and
+faster to load. Strings (file_ids) are stored as UTF-8, everything else
+is pickled. Values written by an unknown codec version decode to None,
+so changing the dataclasses only causes cache misses. Car dates keep
+microseconds and the UTC offset of aware values, but not the name of
+their time zone.
+"""
+import pickle
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from avbot.avtonomer import AN_BASE_URL, AvCar, AvSearchResult
+
+MAGIC = 0xa5
+VERSION = 3
+
+KIND_PICKLE = 0
+KIND_STR = 1
+KIND_SEARCH_RESULT = 2
+
+FLAG_COMPRESSED = 1
+
+# compressing and decompressing costs more CPU than search results of
+# a few kilobytes save in memory
+COMPRESS_MIN_SIZE = 4096
+
+URL_PREFIXES = [""] + [f"{AN_BASE_URL}/"] + [
+    f"https://img{i:02d}.platesmania.com/" for i in range(1, 21)
+]
+_prefix_indexes = {
+    prefix: i for i, prefix in enumerate(URL_PREFIXES) if prefix}
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+_header = struct.Struct("!BBBB")
+
+
+def _split_url(url):
+    # all prefixes are scheme and host
+    prefix = url[:url.find("/", 8) + 1]
+    index = _prefix_indexes.get(prefix)
+    if index is None:
+        return 0, url
+    return index, url[len(prefix):]
+
+
+def _pack_date(value):
+    """Return microseconds since epoch of the local time and UTC offset"""
+    offset = value.utcoffset()
+    return (
+        (value.replace(tzinfo=None) - EPOCH) // MICROSECOND,
+        None if offset is None else int(offset.total_seconds()),
+    )
+
+
+def _unpack_date(microseconds, offset):
+    value = EPOCH + timedelta(microseconds=microseconds)
+    if offset is not None:
+        value = value.replace(tzinfo=timezone(timedelta(seconds=offset)))
+    return value
+
+
+def _pack_search_result(result):
+    return pickle.dumps((result.total_results, [
+        (
+            *_pack_date(car.date), car.make, car.model,
+            *_split_url(car.page_url), *_split_url(car.photo_url),
+            *_split_url(car.thumb_url), car.license_plate,
+        )
+        for car in result.cars
+    ]), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack_search_result(data):
+    total_results, cars = pickle.loads(data)
+    prefixes = URL_PREFIXES
+    return AvSearchResult(total_results, [
+        AvCar(
+            make, model, _unpack_date(microseconds, offset),
+            prefixes[page_prefix] + page_url,
+            prefixes[photo_prefix] + photo_url,
+            prefixes[thumb_prefix] + thumb_url,
+            license_plate,
+        )
+        for (
+            microseconds, offset, make, model, page_prefix, page_url,
+            photo_prefix, photo_url, thumb_prefix, thumb_url, license_plate,
+        ) in cars
+    ])
+
+
+def dumps(value, compress=True, compress_min_size=COMPRESS_MIN_SIZE):
+    if isinstance(value, AvSearchResult):
+        kind, body = KIND_SEARCH_RESULT, _pack_search_result(value)
+    elif isinstance(value, str):
+        kind, body = KIND_STR, value.encode("utf-8")
+    else:
+        kind, body = KIND_PICKLE, pickle.dumps(value)
+    flags = 0
+    if compress and len(body) >= compress_min_size:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_COMPRESSED
+    return _header.pack(MAGIC, VERSION, kind, flags) + body
+
+
+def loads(data):
+    if data[0] != MAGIC:
+        # written before the codec was introduced
+        return pickle.loads(data)
+    _, version, kind, flags = _header.unpack_from(data, 0)
+    if version != VERSION:
+        return None
+    body = data[_header.size:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+    if kind == KIND_SEARCH_RESULT:
+        return _unpack_search_result(body)
+    if kind == KIND_STR:
+        return body.decode("utf-8")
+    return pickle.loads(body)
@@ -8,11 +8,14 @@ from telegram import (
     InlineKeyboardMarkup)
 from telegram.ext import (
     CallbackContext, CommandHandler, Filters, MessageHandler,
-    CallbackQueryHandler)
+    CallbackQueryHandler, TypeHandler)
 
-from avbot import cache, db, models, settings, tasks, version
+from avbot import (
+    cache, db, models, profiling, settings, tasks, tracing, version,
+)
 from avbot.i18n import translations, get_current_lang, setup_locale, _, __
-from avbot.plate_formats import PLATE_FORMATS, get_plate_format_by_type
+from avbot.plate_formats import PLATE_FORMATS, find_plate_formats, \
+    get_plate_format_by_type
 from avbot.utils import validate_vin
 
 logger = logging.getLogger(__name__)
@@ -76,8 +79,7 @@ def on_setlang_command(update: Update, context: CallbackContext):
 def on_setlang_query(update: Update, context: CallbackContext, lang: str):
     user = context.user_data.get("user")
     if lang in translations:
-        user.language_code = lang
-        db.session.commit()
+        db.update_user(user, language_code=lang)
         setup_locale(lang)
     update.callback_query.message.edit_text(
         _("Current language: {}").format(
@@ -108,8 +110,7 @@ def on_setcountry_query(update: Update, context: CallbackContext, arg: str):
     country = int(arg)
     user = context.user_data.get("user")
     if country in models.COUNTRY_LABELS:
-        user.country = country
-        db.session.commit()
+        db.update_user(user, country=country)
     update.callback_query.message.edit_text(
         _("Current country: {}").format(
             models.COUNTRY_LABELS[country]
@@ -141,13 +142,8 @@ def on_search_query(update: Update, context: CallbackContext):
     if query.startswith("/"):  # handle like normal request
         query = query[1:]
 
-    found = []
-    for country_code, plates in PLATE_FORMATS.items():
-        for plate in plates:
-            validated = plate.validate(query)
-            if validated:
-                found.append((validated, country_code, plate))
-
+    with tracing.span("validate"):
+        found = find_plate_formats(query)
     found_count = len(found)
     # TODO reduce results using user.country_code
     if found_count == 0:
@@ -157,11 +153,15 @@ def on_search_query(update: Update, context: CallbackContext):
         )
     elif found_count == 1:
         (validated_query, country_code, plate) = found[0]
-        search_query = db.add_search_query(
-            user, validated_query, plate.num_type)
-        plate.task.delay(
-            chat_id, message_id, search_query.id,
-            language=get_current_lang())
+        with tracing.span("db_write"):
+            search_query = db.add_search_query(
+                user, validated_query, plate.num_type)
+        tracing.link_search_query(search_query.id)
+        with tracing.span("enqueue"):
+            plate.task.delay(
+                chat_id, message_id, search_query.id,
+                month=db.get_search_query_month(search_query),
+                language=get_current_lang())
         context.bot.send_chat_action(
             update.effective_user.id, ChatAction.TYPING)
     else:
@@ -199,13 +199,17 @@ def on_specifyplate_query(update: Update, context: CallbackContext, arg: str):
         "{} {}".format(new_message, plate.description),
         reply_markup=None,
     )
-    search_query = db.add_search_query(
-        user, validated_query, plate.num_type)
+    with tracing.span("db_write"):
+        search_query = db.add_search_query(
+            user, validated_query, plate.num_type)
+    tracing.link_search_query(search_query.id)
     chat_id = update.callback_query.message.chat_id
     message_id = update.callback_query.message.message_id
-    plate.task.delay(
-        chat_id, message_id, search_query.id,
-        language=get_current_lang())
+    with tracing.span("enqueue"):
+        plate.task.delay(
+            chat_id, message_id, search_query.id,
+            month=db.get_search_query_month(search_query),
+            language=get_current_lang())
     context.bot.send_chat_action(
         update.effective_user.id, ChatAction.TYPING)
 
@@ -224,9 +228,12 @@ def on_query_callback(update: Update, context: CallbackContext):
 
 def on_search_paginate(update: Update, context: CallbackContext):
     query = update.callback_query
-    search_query_id, page_str = query.data.split("-", maxsplit=1)
+    # buttons sent before the month hint have no third part
+    search_query_id, page_str, *month = query.data.split("-")
     page = int(page_str)
-    search_query = db.get_search_query(int(search_query_id))
+    month = month[0] if month else None
+    with tracing.span("db_read"):
+        search_query = db.get_search_query(int(search_query_id), month)
     if not search_query:
         logger.warning("Invalid search query id %s", search_query_id)
         query.message.reply_text(
@@ -234,14 +241,17 @@ def on_search_paginate(update: Update, context: CallbackContext):
         )
         return
 
-    db.add_inline_query(search_query, page_str)
+    with tracing.span("db_write"):
+        db.add_inline_query(search_query, page_str)
+    tracing.link_search_query(search_query.id)
     chat_id = query.message.chat_id
     message_id = query.message.message_id
     lang = get_current_lang()
     plate_format = get_plate_format_by_type(search_query.num_type)
-    plate_format.task.delay(
-        chat_id, message_id, search_query.id, page=page, edit=True,
-        language=lang)
+    with tracing.span("enqueue"):
+        plate_format.task.delay(
+            chat_id, message_id, search_query.id, page=page, edit=True,
+            month=month, language=lang)
 
 
 def on_unsupported_msg(update: Update, context: CallbackContext):
@@ -283,6 +293,7 @@ def on_error(update: Update, context: CallbackContext):
 
 
 def on_preprocess_update(update: Update, context: CallbackContext):
+    tracing.start_trace()
     lang = "en"
     user = None
 
@@ -300,11 +311,45 @@ def on_preprocess_update(update: Update, context: CallbackContext):
     setup_locale(lang)
 
 
+def on_postprocess_update(update: Update, context: CallbackContext):
+    context.user_data.pop("user", None)
+    db.session.remove()
+    tracing.end_trace()
+
+
+def on_trace_command(update: Update, context: CallbackContext):
+    """Show timing of the stages of a search query, admins only"""
+    if not context.args or not context.args[0].isdigit():
+        update.message.reply_text("Usage: /trace <search_query_id>")
+        return
+    traces = tracing.get_traces(int(context.args[0]))
+    if not traces:
+        update.message.reply_text("No traces found")
+        return
+    lines = []
+    for correlation_id, spans in traces:
+        lines.append(f"*{correlation_id}*")
+        if not spans:
+            continue
+        started_at = spans[0]["at"]
+        for span in spans:
+            offset = (span["at"] - started_at) * 1000
+            lines.append(
+                f"`+{offset:7.1f} {span['ms']:7.1f} ms {span['stage']}`")
+        lines.append("")
+    update.message.reply_markdown("\n".join(lines))
+
+
 def register_commands(dp):
     dp.add_handler(MessageHandler(Filters.update, on_preprocess_update), 0)
     dp.add_handler(CallbackQueryHandler(on_preprocess_update), 0)
     dp.add_handler(CommandHandler("start", on_start_command), 1)
     dp.add_handler(CommandHandler("version", on_version_command), 1)
+    if settings.ADMIN_IDS:
+        dp.add_handler(CommandHandler(
+            "trace", on_trace_command,
+            filters=Filters.user(user_id=settings.ADMIN_IDS),
+        ), 1)
     dp.add_handler(MessageHandler(
         Filters.update.edited_message, on_edit_message,
     ), 1)
@@ -324,4 +369,10 @@ def register_commands(dp):
     dp.add_handler(MessageHandler(Filters.text, on_search_query), 1)
     dp.add_handler(MessageHandler(Filters.update, on_unsupported_msg), 1)
     dp.add_handler(CallbackQueryHandler(on_query_callback), 1)
+    dp.add_handler(TypeHandler(Update, on_postprocess_update), 2)
     dp.add_error_handler(on_error)
+    if settings.PROFILE_SAMPLE_RATE:
+        for handlers in dp.handlers.values():
+            for handler in handlers:
+                handler.callback = profiling.profile_callback(
+                    handler.callback)
@@ -1,16 +1,103 @@
+import logging
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.pool import QueuePool
 
+from avbot import cache
+from avbot import metrics
 from avbot import models
 from avbot import settings
 
-engine = create_engine(settings.DATABASE_URL)
+WRITE_BEHIND_KEY = "db-write-behind"
+WRITE_BEHIND_DEAD_KEY = "db-write-behind-dead"
+
+logger = logging.getLogger(__name__)
+
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "connects": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "invalidations": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+}
+
+
+def _inc_pool_stat(name, value=1):
+    with _pool_stats_lock:
+        _pool_stats[name] += value
+    metrics.DB_POOL_EVENTS.labels(name).inc(value)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool which records how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.monotonic() - start
+            metrics.DB_POOL_WAIT_SECONDS.observe(wait_time)
+            with _pool_stats_lock:
+                _pool_stats["wait_time"] += wait_time
+                if wait_time > _pool_stats["max_wait_time"]:
+                    _pool_stats["max_wait_time"] = wait_time
+
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
 Session = sessionmaker(bind=engine)
-Session.configure(bind=engine)
-session = Session()
+# one session per thread, removed at the end of every update and task
+session = scoped_session(Session)
+
+
+@event.listens_for(engine, "connect")
+def on_connect(dbapi_connection, connection_record):
+    _inc_pool_stat("connects")
+
+
+@event.listens_for(engine, "checkout")
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _inc_pool_stat("checkouts")
+    metrics.DB_POOL_CHECKED_OUT.inc()
+
+
+@event.listens_for(engine, "checkin")
+def on_checkin(dbapi_connection, connection_record):
+    _inc_pool_stat("checkins")
+    metrics.DB_POOL_CHECKED_OUT.dec()
+
+
+@event.listens_for(engine, "invalidate")
+def on_invalidate(dbapi_connection, connection_record, exception):
+    _inc_pool_stat("invalidations")
+
+
+def get_pool_stats():
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    pool = engine.pool
+    stats.update({
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    })
+    return stats
 
 
 def get_one_or_create(model, create_method="", create_method_kwargs=None,
@@ -29,8 +116,79 @@ def get_one_or_create(model, create_method="", create_method_kwargs=None,
             return session.query(model).filter_by(**kwargs).one(), False
 
 
+# invalidated in all processes by cache.delete
+user_cache = cache.LocalCache(
+    settings.USER_CACHE_SIZE, settings.USER_CACHE_LOCAL_TTL, shared=True)
+_user_cache_stats = {
+    "local_hits": 0,
+    "redis_hits": 0,
+    "misses": 0,
+}
+
+
+_user_cache_stats_lock = threading.Lock()
+
+
+def _inc_user_cache_stat(name):
+    with _user_cache_stats_lock:
+        _user_cache_stats[name] += 1
+    metrics.USER_CACHE_REQUESTS.labels(name).inc()
+
+
+def _user_cache_key(telegram_id):
+    return f"user-{telegram_id}"
+
+
+def _get_cached_user(telegram_id):
+    key = _user_cache_key(telegram_id)
+    row = user_cache.get(key)
+    if row:
+        _inc_user_cache_stat("local_hits")
+    else:
+        row = cache.get(key)
+        if row:
+            _inc_user_cache_stat("redis_hits")
+            user_cache.set(key, row)
+        else:
+            _inc_user_cache_stat("misses")
+            return None
+    return models.User(**row)
+
+
+def _cache_user(user):
+    key = _user_cache_key(user.telegram_id)
+    row = {
+        "id": user.id,
+        "telegram_id": user.telegram_id,
+        "language_code": user.language_code,
+        "country": user.country,
+    }
+    user_cache.set(key, row)
+    cache.add(key, row, settings.USER_CACHE_TTL)
+
+
+def invalidate_user(telegram_id):
+    key = _user_cache_key(telegram_id)
+    user_cache.delete(key)
+    cache.delete(key)
+
+
+def get_user_cache_stats():
+    with _user_cache_stats_lock:
+        stats = dict(_user_cache_stats)
+    total = sum(stats.values())
+    stats["hit_rate"] = (
+        (stats["local_hits"] + stats["redis_hits"]) / total
+        if total else 0.0
+    )
+    return stats
+
+
 def get_or_create_user(telegram_id, first_name, last_name, username,
                        language_code):
+    cached_user = _get_cached_user(telegram_id)
+    if cached_user:
+        return cached_user
     user, _ = get_one_or_create(
         models.User,
         create_method_kwargs={
@@ -42,6 +200,7 @@ def get_or_create_user(telegram_id, first_name, last_name, username,
         },
         telegram_id=telegram_id,
     )
+    _cache_user(user)
     return user
 
 
@@ -50,30 +209,200 @@ def get_user_by_id(user_id):
 
 
 def get_user(telegram_id):
-    return session.query(models.User)\
+    cached_user = _get_cached_user(telegram_id)
+    if cached_user:
+        return cached_user
+    user = session.query(models.User)\
         .filter_by(telegram_id=telegram_id).first()
+    if user:
+        _cache_user(user)
+    return user
+
+
+def update_user(user, **fields):
+    session.query(models.User).filter_by(id=user.id).update(fields)
+    session.commit()
+    for name, value in fields.items():
+        setattr(user, name, value)
+    invalidate_user(user.telegram_id)
+
+
+class IdAllocator:
+    """Hand out ids reserved from a sequence in blocks"""
+
+    def __init__(self, sequence, block_size):
+        self.sequence = sequence
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if not self._ids:
+                with engine.connect() as conn:
+                    self._ids.extend(conn.execute(
+                        text("SELECT nextval(:seq) FROM generate_series(1, :n)"),
+                        {"seq": self.sequence, "n": self.block_size},
+                    ).scalars())
+            return self._ids.popleft()
+
+
+search_query_ids = IdAllocator(
+    "search_query_id_seq", settings.DB_ID_BLOCK_SIZE)
+
+
+def _pending_search_query_key(search_query_id):
+    return f"search_query-{search_query_id}"
 
 
 def add_search_query(user, query_text, num_type="ru"):
-    search_query = models.SearchQuery(
-        query_text=query_text,
-        num_type=num_type,
-        created_at=datetime.utcnow(),
+    if not settings.DB_WRITE_BEHIND:
+        search_query = models.SearchQuery(
+            user_id=user.id,
+            query_text=query_text,
+            num_type=num_type,
+            created_at=datetime.utcnow(),
+        )
+        session.add(search_query)
+        session.commit()
+        return search_query
+
+    row = {
+        "id": search_query_ids.next(),
+        "user_id": user.id,
+        "query_text": query_text,
+        "num_type": num_type,
+        "created_at": datetime.utcnow(),
+    }
+    cache.add(
+        _pending_search_query_key(row["id"]), row,
+        settings.DB_PENDING_TTL,
     )
-    user.search_queries.append(search_query)
-    session.commit()
-    return search_query
+    cache.push(WRITE_BEHIND_KEY, (models.SearchQuery.__tablename__, row))
+    return models.SearchQuery(**row)
+
+
+def get_search_query_month(search_query):
+    """Return partition hint of the search query for get_search_query"""
+    return f"{search_query.created_at:%y%m}"
 
 
-def get_search_query(search_query_id):
-    return session.query(models.SearchQuery).get(search_query_id)
+def get_search_query(search_query_id, month=None):
+    """Return search query by id
+
+    search_query is partitioned by created_at, so without the month hint
+    the lookup probes the primary key index of every partition.
+    """
+    if settings.DB_WRITE_BEHIND:
+        row = cache.get(_pending_search_query_key(search_query_id))
+        if row:
+            return models.SearchQuery(**row)
+    query = session.query(models.SearchQuery)\
+        .filter_by(id=search_query_id)
+    if month:
+        since = datetime.strptime(month, "%y%m")
+        until = datetime(since.year + since.month // 12,
+                         since.month % 12 + 1, 1)
+        query = query.filter(
+            models.SearchQuery.created_at >= since,
+            models.SearchQuery.created_at < until,
+        )
+    return query.first()
 
 
 def add_inline_query(search_query, query):
-    inline_query = models.InlineQuery(
-        query=query,
-        created_at=datetime.utcnow(),
+    if not settings.DB_WRITE_BEHIND:
+        inline_query = models.InlineQuery(
+            query=query,
+            created_at=datetime.utcnow(),
+        )
+        inline_query.search_query_id = search_query.id
+        session.add(inline_query)
+        session.commit()
+        return inline_query
+
+    row = {
+        "search_query_id": search_query.id,
+        "query": query,
+        "created_at": datetime.utcnow(),
+    }
+    cache.push(WRITE_BEHIND_KEY, (models.InlineQuery.__tablename__, row))
+    return models.InlineQuery(**row)
+
+
+def _insert_entries(entries):
+    rows = {}
+    for table_name, row, *_ in entries:
+        rows.setdefault(table_name, []).append(row)
+    with engine.begin() as conn:
+        for model in (models.SearchQuery, models.InlineQuery):
+            if model.__tablename__ in rows:
+                conn.execute(
+                    model.__table__.insert(), rows[model.__tablename__])
+
+
+def _retry_entry(entry):
+    """Push failed row back or to the dead-letter list after max attempts"""
+    table_name, row, *rest = entry
+    attempts = (rest[0] if rest else 0) + 1
+    if attempts < settings.DB_FLUSH_MAX_ATTEMPTS:
+        cache.push(WRITE_BEHIND_KEY, (table_name, row, attempts))
+        return
+    logger.error(f"Moving {table_name} row to {WRITE_BEHIND_DEAD_KEY}")
+    cache.push(WRITE_BEHIND_DEAD_KEY, (table_name, row))
+    metrics.DB_WRITE_BEHIND_DEAD.labels(table_name).inc()
+
+
+def flush_write_behind(batch_size=settings.DB_FLUSH_BATCH):
+    """Bulk insert buffered rows, return number of flushed rows
+
+    Search queries of a batch are inserted before inline queries, so the
+    latter always find the rows they reference. The batch is taken off
+    the list atomically, so several flushers don't insert it twice. If
+    the batch fails, its rows are inserted one by one and the failing
+    ones are retried later. While the database is unavailable, the rows
+    are put back.
+    """
+    entries = cache.pop_list(WRITE_BEHIND_KEY, batch_size)
+    if not entries:
+        return 0
+    try:
+        _insert_entries(entries)
+        return len(entries)
+    except OperationalError:
+        cache.push_front(WRITE_BEHIND_KEY, *entries)
+        raise
+    except DBAPIError:
+        logger.exception("write-behind batch failed, inserting rows one by one")
+    for i, entry in enumerate(entries):
+        try:
+            _insert_entries([entry])
+        except OperationalError:
+            cache.push_front(WRITE_BEHIND_KEY, *entries[i:])
+            raise
+        except DBAPIError:
+            logger.exception(f"Failed to insert {entry[0]} row")
+            _retry_entry(entry)
+    return len(entries)
+
+
+def run_flusher(stop_event, interval=settings.DB_FLUSH_INTERVAL):
+    while True:
+        stopped = stop_event.wait(interval)
+        try:
+            while flush_write_behind() >= settings.DB_FLUSH_BATCH:
+                pass
+        except Exception:
+            logger.exception("write-behind flush failed")
+        if stopped:
+            return
+
+
+def start_flusher():
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=run_flusher, args=(stop_event, ),
+        name="db-flusher", daemon=True,
     )
-    search_query.inline_queries.append(inline_query)
-    session.commit()
-    return inline_query
+    thread.start()
+    return stop_event, thread
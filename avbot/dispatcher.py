@@ -0,0 +1,78 @@
+import logging
+import threading
+from queue import Queue
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from avbot import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedDispatcher(Dispatcher):
+    """Dispatcher which handles updates of different users concurrently
+
+    Updates are distributed among shards by user, every shard handles its
+    updates one by one in its own thread, so updates of one user keep
+    their order.
+    """
+
+    def __init__(self, *args, shards=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = shards
+        self._shard_queues = []
+        self._shard_threads = []
+
+    def get_shard(self, update):
+        if update.effective_user:
+            key = update.effective_user.id
+        elif update.effective_chat:
+            key = update.effective_chat.id
+        else:
+            key = update.update_id
+        return key % self.shards
+
+    def start(self, ready=None):
+        self.start_shards()
+        try:
+            super().start(ready)
+        finally:
+            self.stop_shards()
+
+    def start_shards(self):
+        for i in range(self.shards):
+            queue = Queue()
+            thread = threading.Thread(
+                target=self._run_shard, args=(queue, ),
+                name=f"dispatcher-shard-{i}", daemon=True,
+            )
+            thread.start()
+            self._shard_queues.append(queue)
+            self._shard_threads.append(thread)
+
+    def stop_shards(self):
+        """Handle the queued updates and stop shard threads"""
+        for queue in self._shard_queues:
+            queue.put(None)
+        for thread in self._shard_threads:
+            thread.join()
+        self._shard_queues = []
+        self._shard_threads = []
+
+    def process_update(self, update):
+        if not isinstance(update, Update) or not self._shard_queues:
+            super().process_update(update)
+            return
+        self._shard_queues[self.get_shard(update)].put(update)
+
+    def _run_shard(self, queue):
+        while True:
+            update = queue.get()
+            if update is None:
+                break
+            try:
+                with metrics.UPDATE_SECONDS.time():
+                    super().process_update(update)
+            except Exception:
+                logger.exception("Failed to process update")
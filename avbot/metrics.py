@@ -0,0 +1,161 @@
+"""Prometheus metrics of the bot and workers
+
+Processes of Celery prefork pool can't serve their own metrics, so when
+PROMETHEUS_MULTIPROC_DIR is set all processes write values to files in
+it and the server of the main process collects them from there. The
+variable has to be set before the start.
+"""
+import glob
+import logging
+import os
+
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+BREAKER_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "avbot_upstream_request_seconds",
+    "Time of platesmania requests",
+    ["upstream", "status"],
+)
+UPSTREAM_REJECTED = Counter(
+    "avbot_upstream_rejected_total",
+    "Platesmania requests not done because of rate limit or breaker",
+    ["upstream", "reason"],
+)
+PARSE_SECONDS = Histogram(
+    "avbot_parse_seconds",
+    "Time of search results parsing",
+    ["parser"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "avbot_telegram_request_seconds",
+    "Time of Bot API calls done by tasks",
+    ["method"],
+)
+TELEGRAM_RETRIES = Counter(
+    "avbot_telegram_retries_total",
+    "Bot API calls retried because of flood control",
+    ["method"],
+)
+CACHE_REQUESTS = Counter(
+    "avbot_cache_requests_total",
+    "Cache lookups by key family",
+    ["family", "tier", "result"],
+)
+USER_CACHE_REQUESTS = Counter(
+    "avbot_user_cache_requests_total",
+    "User lookups by result",
+    ["result"],
+)
+DB_POOL_EVENTS = Counter(
+    "avbot_db_pool_events_total",
+    "Database connection pool events",
+    ["event"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "avbot_db_pool_checked_out",
+    "Database connections in use",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "avbot_db_pool_wait_seconds",
+    "Time waited for a database connection",
+    buckets=(.0005, .001, .005, .01, .05, .1, .5, 1, 5, 30),
+)
+DB_WRITE_BEHIND_DEAD = Counter(
+    "avbot_db_write_behind_dead_total",
+    "Buffered rows moved to the dead-letter list after failed inserts",
+    ["table"],
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "avbot_task_queue_wait_seconds",
+    "Time between task publishing and its start",
+    ["task"],
+)
+TASK_SECONDS = Histogram(
+    "avbot_task_seconds",
+    "Time of task runs",
+    ["task", "state"],
+)
+TASK_RETRIES = Counter(
+    "avbot_task_retries_total",
+    "Task retries",
+    ["task"],
+)
+UPDATE_SECONDS = Histogram(
+    "avbot_update_seconds",
+    "Time of update handling",
+)
+
+_breakers = []
+
+
+def add_breaker(breaker):
+    """Report state of the circuit breaker when metrics are collected"""
+    _breakers.append(breaker)
+
+
+class BreakerStateCollector:
+    """Read states of the circuit breakers from Redis at scrape time
+
+    The breakers are shared by all processes and become half-open by
+    expiry, so their state isn't tracked in the processes.
+    """
+
+    def _family(self):
+        return GaugeMetricFamily(
+            "avbot_upstream_breaker_state",
+            "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+            labels=["upstream"],
+        )
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        for breaker in _breakers:
+            try:
+                state = breaker.get_state()
+            except Exception:
+                logger.exception(f"Failed to get state of {breaker.name}")
+                continue
+            family.add_metric([breaker.name], BREAKER_STATES[state])
+        yield family
+
+
+def is_multiprocess():
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def start_server(port):
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    registry.register(BreakerStateCollector())
+    start_http_server(port, registry=registry)
+
+
+def clear_multiprocess_dir():
+    """Drop values of previous runs, call before processes are started"""
+    if is_multiprocess():
+        path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        own_suffix = f"_{os.getpid()}.db"
+        for filename in glob.glob(os.path.join(path, "*.db")):
+            if not filename.endswith(own_suffix):
+                os.remove(filename)
+
+
+def mark_process_dead(pid):
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
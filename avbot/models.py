@@ -34,7 +34,7 @@ COUNTRY_LABELS = {
 class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(BigInteger, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False, unique=True, index=True)
     first_name = Column(String)
     last_name = Column(String)
     username = Column(String)
@@ -46,18 +46,23 @@ class User(Base):
 
 class SearchQuery(Base):
     __tablename__ = "search_query"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False,
+                     index=True)
     query_text = Column(String)
     num_type = Column(String(32), nullable=False)
-    created_at = Column(DateTime)
-    inline_queries = relationship("InlineQuery")
+    created_at = Column(DateTime, primary_key=True)
+    inline_queries = relationship(
+        "InlineQuery",
+        primaryjoin="SearchQuery.id == foreign(InlineQuery.search_query_id)",
+    )
 
 
 class InlineQuery(Base):
     __tablename__ = "inline_query"
-    id = Column(Integer, primary_key=True)
-    search_query_id = Column(Integer, ForeignKey("search_query.id"),
-                             nullable=False)
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    search_query_id = Column(Integer, nullable=False, index=True)
     query = Column(String)
-    created_at = Column(DateTime)
+    created_at = Column(DateTime, primary_key=True)
@@ -0,0 +1,131 @@
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+PARTITIONED_TABLES = ("search_query", "inline_query")
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt, months):
+    month = dt.month - 1 + months
+    return datetime(dt.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y_%m}"
+
+
+def parse_partition_name(table, name):
+    res = re.match(rf"^{table}_p(\d{{4}})_(\d{{2}})$", name)
+    if res:
+        return datetime(int(res.group(1)), int(res.group(2)), 1)
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def table_exists(conn, name):
+    return conn.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name},
+    ).scalar()
+
+
+def create_partition(conn, table, since):
+    """Create partition of table for the month starting at since
+
+    Postgres refuses to create a partition while the default partition
+    holds rows of its range, e.g. after the maintenance was missed. Then
+    the default partition is detached, the rows are moved to the new
+    partition and the default partition is attached back.
+    """
+    name = partition_name(table, since)
+    if table_exists(conn, name):
+        return
+    until = add_months(since, 1)
+    bounds = f"FROM ('{since.isoformat()}') TO ('{until.isoformat()}')"
+    default = default_partition_name(table)
+    in_range = (
+        f"created_at >= '{since.isoformat()}' "
+        f"AND created_at < '{until.isoformat()}'"
+    )
+    has_rows = table_exists(conn, default) and conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"
+    )).scalar()
+    if not has_rows:
+        conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+    conn.execute(text(
+        f"INSERT INTO {name} SELECT * FROM {default} WHERE {in_range}"))
+    conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+    conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logger.info(f"Rows of {name} moved out of {default}")
+
+
+def create_partitions(conn, table, start, months):
+    """Create monthly partitions of table from start for given months"""
+    start = month_start(start)
+    for i in range(months):
+        create_partition(conn, table, add_months(start, i))
+
+
+def get_partitions(conn, table):
+    return conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table ORDER BY c.relname"
+    ), {"table": table}).scalars().all()
+
+
+def detach_partitions(conn, table, before, drop=False):
+    """Detach partitions of table holding rows older than before
+
+    Detached partitions become plain tables which can be dumped and
+    archived, with drop they are removed right away.
+    """
+    detached = []
+    for name in get_partitions(conn, table):
+        start = parse_partition_name(table, name)
+        if start is None or add_months(start, 1) > before:
+            continue
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+        logger.info(f"Partition {name} {'dropped' if drop else 'detached'}")
+    return detached
+
+
+def maintain_partitions(engine, now, months_ahead, retention_months, drop):
+    """Create partitions ahead and detach old ones
+
+    Every step runs in its own transaction, so a failure of one doesn't
+    roll back or skip the others.
+    """
+    for table in PARTITIONED_TABLES:
+        try:
+            with engine.begin() as conn:
+                create_partitions(conn, table, now, months_ahead + 1)
+        except Exception:
+            logger.exception(f"Failed to create partitions of {table}")
+        if not retention_months:
+            continue
+        before = add_months(month_start(now), -retention_months)
+        try:
+            with engine.begin() as conn:
+                detach_partitions(conn, table, before, drop)
+        except Exception:
+            logger.exception(f"Failed to detach partitions of {table}")
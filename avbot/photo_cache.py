@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EVICT_EVERY = 100
+
+
+class PhotoCache:
+    """Content-addressed on-disk cache of photos with LRU eviction
+
+    Photo bytes are stored once per content hash in blobs/, urls/ holds
+    a symlink per URL pointing to its blob. Hits touch the blob, and the
+    least recently used blobs are removed when the cache grows above
+    max_size bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.blobs_path = os.path.join(path, "blobs")
+        self.urls_path = os.path.join(path, "urls")
+        os.makedirs(self.blobs_path, exist_ok=True)
+        os.makedirs(self.urls_path, exist_ok=True)
+        self._writes = 0
+
+    def _url_path(self, url):
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.urls_path, name)
+
+    def open(self, url):
+        """Return a file opened for reading or None"""
+        try:
+            fp = open(self._url_path(url), "rb")
+        except OSError:
+            return None
+        try:
+            os.utime(fp.fileno())
+        except OSError:
+            pass
+        return fp
+
+    def store(self, url, content):
+        """Store photo, errors are logged as the cache is best-effort"""
+        try:
+            self._store(url, content)
+        except OSError:
+            logger.exception(f"Failed to store photo {url}")
+
+    def _store(self, url, content):
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = os.path.join(self.blobs_path, digest)
+        if not os.path.exists(blob_path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.blobs_path)
+            try:
+                with os.fdopen(fd, "wb") as fp:
+                    fp.write(content)
+                os.replace(tmp_path, blob_path)
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+        # unique per call, threads of a process may store the same url
+        tmp_link = f"{self._url_path(url)}.{uuid.uuid4().hex}.tmp"
+        os.symlink(os.path.join("..", "blobs", digest), tmp_link)
+        os.replace(tmp_link, self._url_path(url))
+
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        blobs = []
+        total_size = 0
+        with os.scandir(self.blobs_path) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # removed or renamed by another process meanwhile
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        if total_size <= self.max_size:
+            return
+
+        blobs.sort()
+        for _, size, path in blobs:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+        with os.scandir(self.urls_path) as entries:
+            for entry in entries:
+                if not os.path.exists(entry.path):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
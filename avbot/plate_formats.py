@@ -1,3 +1,5 @@
+import re
+
 from avbot import models
 from avbot.cmd.base import PlateRequestBase
 from avbot.cmd.ru import RU_PLATES
@@ -19,8 +21,56 @@ PLATE_FORMATS = {
 }
 
 
+class PlateFormatRegistry:
+    """Validate a query against all plate formats in one pass
+
+    The query is normalized once per distinct normalize function, and a
+    combined pattern of all formats sharing that function rejects most
+    invalid queries with a single match.
+    """
+
+    def __init__(self, plate_formats):
+        self.plates = [
+            (country_code, plate)
+            for country_code, plates in plate_formats.items()
+            for plate in plates
+        ]
+        self.by_type = {plate.num_type: plate for _, plate in self.plates}
+        patterns = {}
+        for _, plate in self.plates:
+            patterns.setdefault(plate.normalize, []).append(
+                plate.pattern.pattern)
+        self.combined = {
+            normalize: re.compile("|".join(f"(?:{p})" for p in group))
+            for normalize, group in patterns.items()
+        }
+
+    def find(self, query):
+        normalized = {}
+        for normalize, combined in self.combined.items():
+            value = normalize(query)
+            if combined.match(value):
+                normalized[normalize] = value
+
+        found = []
+        for country_code, plate in self.plates:
+            if plate.normalize not in normalized:
+                continue
+            validated = plate.validate_normalized(normalized[plate.normalize])
+            if validated:
+                found.append((validated, country_code, plate))
+        return found
+
+    def get(self, num_type):
+        return self.by_type.get(num_type)
+
+
+registry = PlateFormatRegistry(PLATE_FORMATS)
+
+
+def find_plate_formats(query):
+    return registry.find(query)
+
+
 def get_plate_format_by_type(num_type: str) -> PlateRequestBase | None:
-    for country_code, plates in PLATE_FORMATS.items():
-        for plate in plates:
-            if plate.num_type == num_type:
-                return plate
+    return registry.get(num_type)
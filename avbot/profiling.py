@@ -0,0 +1,177 @@
+"""Sampled profiling of tasks and update handlers
+
+PROFILE_SAMPLE_RATE of executions are profiled, with cProfile or with a
+statistical stack sampler (PROFILER). Profiles are aggregated per task
+or handler name and written to PROFILE_DIR/<name>/ every
+PROFILE_FLUSH_SAMPLES samples as pstats or collapsed stacks, which
+flamegraph.pl and speedscope read. Only PROFILE_KEEP newest files of a
+name are kept.
+"""
+import cProfile
+import glob
+import itertools
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from avbot import settings
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}"
+            f":{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Collect stacks of the calling thread every interval seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+
+class ProfileStore:
+    """Profiles of one process aggregated per name"""
+
+    def __init__(self, path, flush_samples, keep):
+        self.path = path
+        self.flush_samples = flush_samples
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._stacks = {}
+        self._samples = Counter()
+        self._counter = itertools.count()
+
+    def add(self, name, profiler):
+        with self._lock:
+            if isinstance(profiler, StackSampler):
+                self._stacks.setdefault(name, Counter()).update(
+                    profiler.stacks)
+            elif name in self._stats:
+                self._stats[name].add(profiler)
+            else:
+                self._stats[name] = pstats.Stats(profiler)
+            self._samples[name] += 1
+            if self._samples[name] < self.flush_samples:
+                return
+            stats = self._stats.pop(name, None)
+            stacks = self._stacks.pop(name, None)
+            del self._samples[name]
+        self._write(name, stats, stacks)
+
+    def flush(self):
+        with self._lock:
+            names = list(self._samples)
+            items = [
+                (name, self._stats.pop(name, None),
+                 self._stacks.pop(name, None))
+                for name in names
+            ]
+            self._samples.clear()
+        for item in items:
+            self._write(*item)
+
+    def _write(self, name, stats, stacks):
+        path = os.path.join(self.path, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            prefix = os.path.join(path, "{}-{}-{}".format(
+                time.strftime("%Y%m%d-%H%M%S"), os.getpid(),
+                next(self._counter),
+            ))
+            if stats is not None:
+                stats.dump_stats(prefix + ".pstats")
+                self._rotate(path, "*.pstats")
+            if stacks:
+                with open(prefix + ".folded", "w") as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+                self._rotate(path, "*.folded")
+        except OSError:
+            logger.exception(f"Failed to write profile of {name}")
+
+    def _rotate(self, path, pattern):
+        filenames = sorted(
+            glob.glob(os.path.join(path, pattern)), key=os.path.getmtime)
+        for filename in filenames[:-self.keep]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+
+store = ProfileStore(
+    settings.PROFILE_DIR,
+    settings.PROFILE_FLUSH_SAMPLES,
+    settings.PROFILE_KEEP,
+)
+
+
+def start():
+    """Return started profiler or None if this execution isn't sampled"""
+    if random.random() >= settings.PROFILE_SAMPLE_RATE:
+        return None
+    if settings.PROFILER == "sampling":
+        profiler = StackSampler(settings.PROFILE_INTERVAL)
+    else:
+        profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is already active in this thread
+        return None
+    return profiler
+
+
+def stop(name, profiler):
+    profiler.disable()
+    store.add(name, profiler)
+
+
+def profile_callback(callback):
+    """Wrap handler callback to profile some of its calls"""
+    @wraps(callback)
+    def wrapper(*args, **kwargs):
+        profiler = start()
+        if profiler is None:
+            return callback(*args, **kwargs)
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            stop(callback.__name__, profiler)
+    return wrapper
@@ -0,0 +1,183 @@
+"""Broker-less execution of Celery tasks inside the bot process
+
+Tasks run as asyncio coroutines on a background event loop, their bodies
+are executed by a bounded thread pool. Retries and time limits follow
+the options of the task, like a Celery worker does.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_postrun, task_prerun
+from celery.utils import uuid
+from celery.utils.time import get_exponential_backoff_interval
+
+logger = logging.getLogger(__name__)
+
+
+def get_retry_delay(task, exc, retries):
+    """Return seconds before the next try or None if it is not retried"""
+    autoretry_for = tuple(getattr(task, "autoretry_for", ()))
+    if not autoretry_for or not isinstance(exc, autoretry_for):
+        return None
+    retry_kwargs = getattr(task, "retry_kwargs", {})
+    max_retries = retry_kwargs.get("max_retries", task.max_retries)
+    if max_retries is not None and retries >= max_retries:
+        return None
+    retry_backoff = float(getattr(task, "retry_backoff", False))
+    if retry_backoff:
+        return get_exponential_backoff_interval(
+            factor=int(max(1.0, retry_backoff)),
+            retries=retries,
+            maximum=int(getattr(task, "retry_backoff_max", 600)),
+            full_jitter=getattr(task, "retry_jitter", True),
+        )
+    return retry_kwargs.get("countdown", task.default_retry_delay)
+
+
+class LocalRunner:
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._executor = None
+        self._semaphore = None
+
+    def submit(self, task, args=None, kwargs=None, countdown=None):
+        """Schedule task, return concurrent Future of its result"""
+        self._ensure_started()
+        # tasks see context variables of the caller, like correlation id
+        context = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(
+            self.run(task, args or (), kwargs or {}, countdown, context),
+            self._loop,
+        )
+
+    def schedule_periodic(self, app):
+        """Run tasks of app's beat schedule which have timedelta schedules"""
+        self._ensure_started()
+        for name, entry in app.conf.beat_schedule.items():
+            schedule = entry["schedule"]
+            if not isinstance(schedule, timedelta):
+                logger.warning(f"Periodic task {name} is not supported")
+                continue
+            asyncio.run_coroutine_threadsafe(
+                self._run_periodic(app.tasks[entry["task"]], schedule),
+                self._loop,
+            )
+
+    async def run(self, task, args, kwargs, countdown=None, context=None):
+        # the time a worker would see in the published_at header
+        published_at = time.time()
+        if countdown:
+            await asyncio.sleep(countdown)
+        task_id = uuid()
+        retries = 0
+        while True:
+            await self._semaphore.acquire()
+            try:
+                return await self._run_once(
+                    task, task_id, args, kwargs, context, published_at)
+            except Exception as exc:
+                error = exc
+            delay = get_retry_delay(task, error, retries)
+            if delay is None:
+                logger.error(
+                    f"Task {task.name}[{task_id}] failed: {error!r}",
+                    exc_info=error,
+                )
+                await self._in_executor(
+                    task.on_failure, error, task_id, args, kwargs, None)
+                return None
+            retries += 1
+            logger.info(
+                f"Task {task.name}[{task_id}] retry {retries} in {delay}s: "
+                f"{error!r}")
+            published_at = time.time()
+            await asyncio.sleep(delay)
+
+    async def _run_once(self, task, task_id, args, kwargs, context=None,
+                        published_at=None):
+        """Run task in a thread, the semaphore has to be acquired before
+
+        The semaphore is released when the thread finishes, also after
+        the time limit, so a hung thread keeps its slot and later tasks
+        never wait for a free thread within their own time limit.
+        """
+        time_limit = task.soft_time_limit or task.time_limit
+        context = (context or contextvars.Context()).copy()
+        submitted = False
+        try:
+            future = self._in_executor(
+                context.run, self._call, task, task_id, args, kwargs,
+                published_at)
+            future.add_done_callback(self._release)
+            submitted = True
+        finally:
+            if not submitted:
+                self._semaphore.release()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), time_limit)
+        except asyncio.TimeoutError:
+            # the thread can't be interrupted, its result is dropped
+            raise SoftTimeLimitExceeded(time_limit)
+
+    def _release(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            # retrieve the error of a dropped run to not log it as lost
+            future.exception()
+
+    def _in_executor(self, func, *args):
+        return self._loop.run_in_executor(self._executor, partial(func, *args))
+
+    def _call(self, task, task_id, args, kwargs, published_at=None):
+        # signal handlers read the headers set by before_task_publish
+        task.push_request(id=task_id, published_at=published_at)
+        try:
+            task_prerun.send(
+                sender=task, task_id=task_id, task=task, args=args,
+                kwargs=kwargs)
+            retval, state = None, "FAILURE"
+            try:
+                retval = task(*args, **kwargs)
+                state = "SUCCESS"
+                return retval
+            finally:
+                task_postrun.send(
+                    sender=task, task_id=task_id, task=task, args=args,
+                    kwargs=kwargs, retval=retval, state=state,
+                )
+        finally:
+            task.pop_request()
+
+    async def _run_periodic(self, task, interval):
+        while True:
+            await asyncio.sleep(interval.total_seconds())
+            await self.run(task, (), {})
+
+    def _ensure_started(self):
+        """Start the event loop once per process (also after fork)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="task")
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            threading.Thread(
+                target=self._loop.run_forever, name="tasks", daemon=True,
+            ).start()
+            self._pid = pid
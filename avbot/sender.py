@@ -0,0 +1,177 @@
+"""Rate limited sending of Telegram Bot API calls
+
+Calls are queued and done by a small thread pool, within global and
+per-chat limits shared by all processes. Flood control errors are retried
+after the time Telegram asks to wait, other errors are set on the Future
+of the call.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram.error import RetryAfter
+
+from avbot import metrics, settings, tracing
+from avbot.upstream import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = kwargs.get("chat_id", args[0] if args else None)
+        self.future = Future()
+        self.attempts = 0
+        self.correlation_id = tracing.get_correlation_id()
+
+    def rewind(self):
+        """Rewind files read by the previous attempt"""
+        for value in itertools.chain(self.args, self.kwargs.values()):
+            if hasattr(value, "seek"):
+                value.seek(0)
+
+
+class Sender:
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bucket = TokenBucket(
+            "telegram", settings.SENDER_GLOBAL_RATE, settings.SENDER_BURST)
+        self._calls = []
+        self._counter = itertools.count()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._pid = None
+        self._executor = None
+
+    def send_message(self, *args, **kwargs):
+        return self.submit("send_message", *args, **kwargs)
+
+    def send_photo(self, *args, **kwargs):
+        return self.submit("send_photo", *args, **kwargs)
+
+    def edit_message_media(self, *args, **kwargs):
+        return self.submit("edit_message_media", *args, **kwargs)
+
+    def forward_message(self, *args, **kwargs):
+        return self.submit("forward_message", *args, **kwargs)
+
+    def submit(self, method, *args, **kwargs):
+        """Queue bot method call, return Future of its result"""
+        self._ensure_started()
+        call = _Call(method, args, kwargs)
+        with self._cond:
+            self._pending += 1
+        self._schedule(call, 0)
+        return call.future
+
+    def flush(self, timeout=None):
+        """Wait until all queued calls are done"""
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _get_chat_bucket(self, chat_id):
+        # Telegram allows less messages per minute to groups and channels
+        if str(chat_id).startswith("-"):
+            rate = settings.SENDER_GROUP_RATE
+        else:
+            rate = settings.SENDER_CHAT_RATE
+        return TokenBucket(
+            f"telegram:{chat_id}", rate, settings.SENDER_CHAT_BURST)
+
+    def _schedule(self, call, delay):
+        with self._cond:
+            heapq.heappush(
+                self._calls,
+                (time.monotonic() + delay, next(self._counter), call),
+            )
+            self._cond.notify_all()
+
+    def _ensure_started(self):
+        """Start dispatching once per process (also after fork)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            self._calls = []
+            self._pending = 0
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.SENDER_WORKERS,
+                thread_name_prefix="sender",
+            )
+            threading.Thread(
+                target=self._dispatch, name="sender-dispatch", daemon=True,
+            ).start()
+            self._pid = pid
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._calls and self._calls[0][0] <= now:
+                        _, _, call = heapq.heappop(self._calls)
+                        break
+                    self._cond.wait(
+                        self._calls[0][0] - now if self._calls else None)
+            try:
+                wait = self._get_chat_bucket(call.chat_id).take(self.bucket)
+            except Exception:
+                logger.exception("Failed to take a token, sending anyway")
+                wait = 0
+            if wait:
+                self._schedule(call, wait)
+            else:
+                self._executor.submit(self._call, call)
+
+    def _call(self, call):
+        call.attempts += 1
+        start = time.perf_counter()
+        try:
+            with metrics.TELEGRAM_REQUEST_SECONDS.labels(call.method).time():
+                result = getattr(self.bot, call.method)(
+                    *call.args, **call.kwargs)
+        except RetryAfter as exc:
+            if call.attempts <= settings.SENDER_MAX_RETRIES:
+                metrics.TELEGRAM_RETRIES.labels(call.method).inc()
+                logger.warning(
+                    f"{call.method} to {call.chat_id} is retried "
+                    f"after {exc.retry_after}s")
+                call.rewind()
+                self._schedule(call, exc.retry_after)
+                return
+            self._done(call, start, exc=exc)
+        except Exception as exc:
+            self._done(call, start, exc=exc)
+        else:
+            self._done(call, start, result=result)
+
+    def _done(self, call, start, result=None, exc=None):
+        tracing.add_span(
+            "telegram", time.perf_counter() - start,
+            correlation_id=call.correlation_id, method=call.method,
+            attempts=call.attempts, ok=exc is None,
+        )
+        if exc is not None:
+            call.future.set_exception(exc)
+        else:
+            call.future.set_result(result)
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
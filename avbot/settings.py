@@ -6,21 +6,109 @@ from avbot import i18n, version
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "1234:test")
 REDIS_CACHE_URL = os.environ.get("REDIS_CACHE_URL", "redis://localhost:6379")
 DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://user:pwd@pg/db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+# rows pushed by the bot and workers are inserted by the flusher thread of
+# the bot process, so at least one bot replica has to run with it
+DB_WRITE_BEHIND = os.environ.get("DB_WRITE_BEHIND", "0") == "1"
+DB_FLUSH_INTERVAL = float(os.environ.get("DB_FLUSH_INTERVAL", "1"))
+DB_FLUSH_BATCH = int(os.environ.get("DB_FLUSH_BATCH", "500"))
+DB_FLUSH_MAX_ATTEMPTS = int(os.environ.get("DB_FLUSH_MAX_ATTEMPTS", "5"))
+DB_ID_BLOCK_SIZE = int(os.environ.get("DB_ID_BLOCK_SIZE", "100"))
+DB_PENDING_TTL = int(os.environ.get("DB_PENDING_TTL", "86400"))
+DB_PARTITIONS_AHEAD = int(os.environ.get("DB_PARTITIONS_AHEAD", "3"))
+DB_RETENTION_MONTHS = int(os.environ.get("DB_RETENTION_MONTHS", "0"))
+DB_RETENTION_DROP = os.environ.get("DB_RETENTION_DROP", "0") == "1"
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_LOCAL_TTL = int(os.environ.get("USER_CACHE_LOCAL_TTL", "60"))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "3600"))
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379")
+# "celery" sends tasks to workers, "local" runs them in the bot process
+TASKS_MODE = os.environ.get("TASKS_MODE", "celery")
+TASKS_LOCAL_CONCURRENCY = int(os.environ.get("TASKS_LOCAL_CONCURRENCY", "8"))
+CELERY_PREFETCH_MULTIPLIER = int(
+    os.environ.get("CELERY_PREFETCH_MULTIPLIER", "1"))
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
 SENTRY_SAMPLE_RATE = float(os.environ.get("SENTRY_SAMPLE_RATE", 0.2))
 FWD_CHAT_ID = os.environ.get("FWD_CHAT_ID")
+PHOTO_STORAGE_CHAT_ID = os.environ.get("PHOTO_STORAGE_CHAT_ID")
+SENDER_WORKERS = int(os.environ.get("SENDER_WORKERS", "4"))
+SENDER_GLOBAL_RATE = float(os.environ.get("SENDER_GLOBAL_RATE", "25"))
+SENDER_BURST = int(os.environ.get("SENDER_BURST", "30"))
+SENDER_CHAT_RATE = float(os.environ.get("SENDER_CHAT_RATE", "1"))
+SENDER_GROUP_RATE = float(os.environ.get("SENDER_GROUP_RATE", "0.33"))
+SENDER_CHAT_BURST = int(os.environ.get("SENDER_CHAT_BURST", "3"))
+SENDER_MAX_RETRIES = int(os.environ.get("SENDER_MAX_RETRIES", "3"))
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+BOT_SHARDS = int(os.environ.get("BOT_SHARDS", "4"))
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "4"))
 WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/")
 WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "localhost")
 WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "5000"))
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0")) or None
+TRACING = os.environ.get("TRACING", "1") == "1"
+TRACE_TTL = int(os.environ.get("TRACE_TTL", "86400"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# "cprofile" writes pstats, "sampling" writes collapsed stacks
+PROFILER = os.environ.get("PROFILER", "cprofile")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/avbot-profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_FLUSH_SAMPLES = int(os.environ.get("PROFILE_FLUSH_SAMPLES", "20"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "10"))
+ADMIN_IDS = [
+    int(admin_id)
+    for admin_id in os.environ.get("ADMIN_IDS", "").split(",")
+    if admin_id.strip()
+]
 PROXY_URL = os.environ.get("PROXY_URL")
 PROXY_USERNAME = os.environ.get("PROXY_USERNAME")
 PROXY_PASSWORD = os.environ.get("PROXY_PASSWORD")
+AN_PARSER = os.environ.get("AN_PARSER", "bs4")
+if AN_PARSER not in ("bs4", "lxml", "stream"):
+    raise ValueError(f"Unknown AN_PARSER {AN_PARSER!r}")
+AN_CONNECT_TIMEOUT = float(os.environ.get("AN_CONNECT_TIMEOUT", "3.05"))
+AN_READ_TIMEOUT = float(os.environ.get("AN_READ_TIMEOUT", "8"))
+AN_POOL_CONNECTIONS = int(os.environ.get("AN_POOL_CONNECTIONS", "4"))
+AN_POOL_MAXSIZE = int(os.environ.get("AN_POOL_MAXSIZE", "10"))
+AN_PHOTO_POOL_MAXSIZE = int(os.environ.get("AN_PHOTO_POOL_MAXSIZE", "10"))
+AN_RATE_LIMIT = float(os.environ.get("AN_RATE_LIMIT", "5"))
+AN_RATE_BURST = int(os.environ.get("AN_RATE_BURST", "10"))
+AN_PHOTO_RATE_LIMIT = float(os.environ.get("AN_PHOTO_RATE_LIMIT", "20"))
+AN_PHOTO_RATE_BURST = int(os.environ.get("AN_PHOTO_RATE_BURST", "40"))
+AN_RATE_LIMIT_WAIT = float(os.environ.get("AN_RATE_LIMIT_WAIT", "3"))
+AN_BREAKER_THRESHOLD = int(os.environ.get("AN_BREAKER_THRESHOLD", "5"))
+AN_BREAKER_WINDOW = int(os.environ.get("AN_BREAKER_WINDOW", "30"))
+AN_BREAKER_COOLDOWN = int(os.environ.get("AN_BREAKER_COOLDOWN", "60"))
+PHOTO_CACHE_DIR = os.environ.get("PHOTO_CACHE_DIR")
+PHOTO_CACHE_MAX_SIZE = int(
+    os.environ.get("PHOTO_CACHE_MAX_SIZE", str(512 * 1024 * 1024)))
 LOCALE_PATH = "avbot/locale"
 VIN_PROVIDER_URL = os.environ.get("VIN_PROVIDER_URL")
 VIN_PROVIDER_TOKEN = os.environ.get("VIN_PROVIDER_TOKEN")
+SEARCH_LOCK_TIMEOUT = int(os.environ.get("SEARCH_LOCK_TIMEOUT", "15"))
+# waiters for a search of another worker wait at least SEARCH_LOCK_TIMEOUT
+SEARCH_WAIT_TIMEOUT = float(os.environ.get("SEARCH_WAIT_TIMEOUT", "20"))
+SEARCH_RESULT_FRESH_TTL = int(os.environ.get("SEARCH_RESULT_FRESH_TTL", "300"))
+SEARCH_RESULT_STALE_TTL = int(os.environ.get("SEARCH_RESULT_STALE_TTL", "3600"))
+SEARCH_EMPTY_RESULT_TTL = int(os.environ.get("SEARCH_EMPTY_RESULT_TTL", "300"))
+CACHE_LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", "0"))
+CACHE_LOCAL_TTL = float(os.environ.get("CACHE_LOCAL_TTL", "10"))
+CACHE_COMPRESS = os.environ.get("CACHE_COMPRESS", "1") == "1"
+CACHE_COMPRESS_MIN_SIZE = int(
+    os.environ.get("CACHE_COMPRESS_MIN_SIZE", "4096"))
+EMPTY_PLATES_INDEX = os.environ.get("EMPTY_PLATES_INDEX", "0") == "1"
+EMPTY_PLATES_CAPACITY = int(os.environ.get("EMPTY_PLATES_CAPACITY", "100000"))
+EMPTY_PLATES_ERROR_RATE = float(
+    os.environ.get("EMPTY_PLATES_ERROR_RATE", "0.001"))
+EMPTY_PLATES_PERIOD = int(os.environ.get("EMPTY_PLATES_PERIOD", "604800"))
+EMPTY_PLATES_GENERATIONS = int(
+    os.environ.get("EMPTY_PLATES_GENERATIONS", "4"))
+EMPTY_PLATES_RECHECK_RATE = float(
+    os.environ.get("EMPTY_PLATES_RECHECK_RATE", "0.05"))
+CACHE_REVALIDATE_TIMEOUT = int(os.environ.get("CACHE_REVALIDATE_TIMEOUT", "60"))
 
 
 REQUEST_KWARGS = (
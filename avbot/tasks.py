@@ -1,19 +1,93 @@
+import asyncio
 import logging
-from datetime import timedelta
+import os
+import random
+import time
+from datetime import datetime, timedelta
 from functools import wraps
 
 import telegram
 from celery import Celery, Task
+from celery.signals import (
+    before_task_publish, task_postrun, task_prerun, task_retry, worker_init,
+    worker_process_shutdown,
+)
 from requests.exceptions import RequestException
+from telegram.utils.request import Request
 
-from avbot import avtonomer, cache, db, settings, vininfo
+from avbot import (
+    avtonomer, bloom, cache, db, metrics, partitions, profiling, settings,
+    tracing, vininfo,
+)
 from avbot.i18n import setup_locale
+from avbot.runner import LocalRunner
+from avbot.sender import Sender
+from avbot.upstream import UpstreamUnavailable
 
 PHOTO_NOT_FOUND = "avbot/assets/not-found.png"
 TASKS_TIME_LIMIT = 15
+PHOTO_FILE_ID_TTL = timedelta(minutes=30)
+
+# queue and priority (0 is the highest on Redis broker) of the tasks
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_SEARCH = "search"
+QUEUE_BULK = "bulk"
+QUEUE_BACKGROUND = "background"
+TASK_ROUTES = {
+    "avbot.tasks.an_paginated_search": (QUEUE_SEARCH, 3),
+    "avbot.tasks.vin_get_info": (QUEUE_SEARCH, 5),
+    "avbot.tasks.an_listed_search": (QUEUE_BULK, 6),
+    "avbot.tasks.prefetch_photos": (QUEUE_BACKGROUND, 8),
+    "avbot.tasks.refresh_search": (QUEUE_BACKGROUND, 9),
+    "avbot.tasks.maintain_partitions": (QUEUE_BACKGROUND, 9),
+}
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Route page switching, which users are waiting for, ahead of all"""
+    if name == "avbot.tasks.an_paginated_search" and kwargs.get("edit"):
+        return {"queue": QUEUE_INTERACTIVE, "priority": 0}
+    queue, priority = TASK_ROUTES.get(name, (QUEUE_SEARCH, 5))
+    return {"queue": queue, "priority": priority}
+
+
+local_runner = (
+    LocalRunner(settings.TASKS_LOCAL_CONCURRENCY)
+    if settings.TASKS_MODE == "local"
+    else None
+)
 
-app = Celery("avbot", broker=settings.CELERY_BROKER_URL)
-bot = telegram.Bot(token=settings.BOT_TOKEN)
+
+class BaseTask(Task):
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        if local_runner is not None:
+            return local_runner.submit(
+                self, args, kwargs, options.get("countdown"))
+        return super().apply_async(args, kwargs, **options)
+
+
+app = Celery(
+    "avbot", broker=settings.CELERY_BROKER_URL, task_cls=BaseTask)
+app.conf.task_routes = (route_task, )
+app.conf.task_default_queue = QUEUE_SEARCH
+app.conf.broker_transport_options = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+app.conf.worker_prefetch_multiplier = settings.CELERY_PREFETCH_MULTIPLIER
+app.conf.beat_schedule = {
+    "maintain-partitions": {
+        "task": "avbot.tasks.maintain_partitions",
+        "schedule": timedelta(hours=6),
+    },
+}
+bot = telegram.Bot(
+    token=settings.BOT_TOKEN,
+    request=Request(con_pool_size=settings.SENDER_WORKERS + 1),
+)
+sender = Sender(bot)
 logger = logging.getLogger(__name__)
 
 
@@ -35,11 +109,12 @@ def get_car_caption(car, plate, page, count):
     )
 
 
-def get_car_reply_markup(cars_count, search_query_id, page):
+def get_car_reply_markup(cars_count, search_query, page):
+    month = db.get_search_query_month(search_query)
     buttons = [[
         telegram.InlineKeyboardButton(
             f"{i + 1}",
-            callback_data=f"{search_query_id}-{i}"
+            callback_data=f"{search_query.id}-{i}-{month}"
         )
         for i in range(cars_count)
         if i != page
@@ -51,17 +126,145 @@ def get_car_reply_markup(cars_count, search_query_id, page):
     )
 
 
-class TelegramTask(Task):
+def log_failure(future):
+    """Log the error of a reply the task doesn't wait for"""
+    def done(future):
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Failed to send reply: {exc!r}")
+    future.add_done_callback(done)
+
+
+def get_photo_cache_key(url):
+    return f"avtonomer.load_photo({url})"
+
+
+def search_plate(plate_format, lp_num):
+    """Search plate unless it is known to have no photos
+
+    Some of the known empty plates are still searched to recheck them.
+    """
+    empty_plates = bloom.get_negative_index(plate_format.num_type)
+    known_empty = lp_num in empty_plates
+    if (
+        known_empty
+        and random.random() >= settings.EMPTY_PLATES_RECHECK_RATE
+    ):
+        return avtonomer.AvSearchResult(0, [])
+    result = plate_format.search(lp_num)
+    if result is None:
+        return result
+    if not result.total_results:
+        empty_plates.add(lp_num)
+    elif known_empty:
+        empty_plates.discard(lp_num)
+    return result
+
+
+def get_search_result_ttl(result):
+    """Return (time, stale_time) of a cached search result
+
+    Results without cars expire early and are never served stale, so
+    new photos show up soon.
+    """
+    if not result.total_results:
+        ttl = settings.SEARCH_EMPTY_RESULT_TTL
+        return ttl, ttl
+    return settings.SEARCH_RESULT_STALE_TTL, settings.SEARCH_RESULT_FRESH_TTL
+
+
+def search_cached(cache_key, plate_format, lp_num, negative_index=False):
+    search = (
+        search_plate
+        if negative_index and settings.EMPTY_PLATES_INDEX
+        else lambda plate_format, lp_num: plate_format.search(lp_num)
+    )
+    try:
+        return cache.single_flight(
+            cache_key,
+            lambda: search(plate_format, lp_num),
+            revalidate=lambda: refresh_search.delay(
+                cache_key, plate_format.num_type, lp_num),
+            get_ttl=get_search_result_ttl,
+        )
+    except UpstreamUnavailable as exc:
+        logger.warning(f"Search of {lp_num} skipped: {exc}")
+        return None
+
+
+_task_started_at = {}
+_task_profilers = {}
+
+
+@task_postrun.connect
+def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    db.session.remove()
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        duration = time.perf_counter() - started_at
+        metrics.TASK_SECONDS.labels(task.name, state).observe(duration)
+        tracing.add_span("task", duration, task=task.name, state=state)
+    tracing.end_trace()
+    profiler = _task_profilers.pop(task_id, None)
+    if profiler is not None:
+        profiling.stop(task.name, profiler)
+
+
+@before_task_publish.connect
+def on_before_task_publish(headers=None, **kwargs):
+    headers["published_at"] = time.time()
+    correlation_id = tracing.get_correlation_id()
+    if correlation_id:
+        headers["correlation_id"] = correlation_id
+
+
+@task_prerun.connect
+def on_task_prerun(task_id=None, task=None, **kwargs):
+    # tasks run in the bot process keep the correlation id of the update
+    tracing.start_trace(
+        task.request.get("correlation_id") or tracing.get_correlation_id())
+    published_at = task.request.get("published_at")
+    if published_at:
+        wait_time = max(0, time.time() - published_at)
+        metrics.TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(wait_time)
+        tracing.add_span("queue_wait", wait_time, task=task.name)
+    _task_started_at[task_id] = time.perf_counter()
+    if settings.PROFILE_SAMPLE_RATE:
+        profiler = profiling.start()
+        if profiler is not None:
+            _task_profilers[task_id] = profiler
+
+
+@task_retry.connect
+def on_task_retry(sender=None, **kwargs):
+    metrics.TASK_RETRIES.labels(sender.name).inc()
+
+
+@worker_init.connect
+def on_worker_init(**kwargs):
+    if settings.METRICS_PORT:
+        metrics.clear_multiprocess_dir()
+        metrics.start_server(settings.METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(pid=None, **kwargs):
+    sender.flush(timeout=TASKS_TIME_LIMIT)
+    metrics.mark_process_dead(pid or os.getpid())
+    profiling.store.flush()
+
+
+class TelegramTask(BaseTask):
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
-        bot.send_message(
+        log_failure(sender.send_message(
             args[0],
             (
                 "Error has occurred, try again later / "
                 "Произошла ошибка, попробуйте ещё раз"
             ),
             reply_to_message_id=args[1],
-        )
+        ))
 
 
 @app.task(
@@ -69,14 +272,16 @@ class TelegramTask(Task):
     bind=True,
     autoretry_for=(RequestException, ),
     retry_kwargs={"max_retries": 2},
-    default_retry_delay=2,
+    retry_backoff=2,
+    retry_jitter=True,
     soft_time_limit=TASKS_TIME_LIMIT,
 )
 @use_translation
 def an_paginated_search(
-    self, chat_id, message_id, search_query_id, page=0, edit=False
+    self, chat_id, message_id, search_query_id, page=0, edit=False,
+    month=None,
 ):
-    search_query = db.get_search_query(search_query_id)
+    search_query = db.get_search_query(search_query_id, month)
     lp_num = search_query.query_text
     lp_type = search_query.num_type
 
@@ -84,61 +289,121 @@ def an_paginated_search(
     plate_format = get_plate_format_by_type(lp_type)
     cache_key = f"an_paginated_search-{lp_type}-{lp_num}"
 
-    result = cache.get(cache_key)
-    if not result:
-        result = plate_format.search(lp_num)
+    result = search_cached(
+        cache_key, plate_format, lp_num, negative_index=True)
 
     if not result:
         logger.warning(f"No data for query {lp_num} {lp_type}")
-        bot.send_message(
+        log_failure(sender.send_message(
             chat_id, plate_format.msg_no_data(),
             reply_to_message_id=message_id,
-        )
+        ))
         return
 
     if not result.total_results:
-        bot.send_message(
+        log_failure(sender.send_message(
             chat_id, plate_format.msg_no_results(lp_num),
             reply_to_message_id=message_id,
-        )
+        ))
         return
 
-    cache.add(cache_key, result, timedelta(minutes=5))
-
     car = result.cars[page]
     cars_count = len(result.cars)
-    cache_key_photo = f"avtonomer.load_photo({car.thumb_url})"
+    cache_key_photo = get_photo_cache_key(car.thumb_url)
 
     file_id = cache.get(cache_key_photo)
+    cache_file_id = not file_id
     if not file_id:
-        photo = avtonomer.load_photo(car.thumb_url)
+        try:
+            photo = avtonomer.load_photo(car.thumb_url)
+        except UpstreamUnavailable as exc:
+            logger.warning(f"Photo {car.thumb_url} skipped: {exc}")
+            photo = None
+            cache_file_id = False
         if not photo:
             photo = open(PHOTO_NOT_FOUND, "rb")
     else:
         photo = file_id
 
     caption = get_car_caption(car, lp_num, page, cars_count)
-    markup = get_car_reply_markup(cars_count, search_query_id, page)
+    markup = get_car_reply_markup(cars_count, search_query, page)
 
     if edit:
-        message = bot.edit_message_media(
+        sent = sender.edit_message_media(
             media=telegram.InputMediaPhoto(photo, caption=caption),
             reply_markup=markup,
             chat_id=chat_id,
             message_id=message_id,
         )
     else:
-        message = bot.send_photo(
+        sent = sender.send_photo(
             chat_id, photo, caption,
             reply_to_message_id=message_id,
             reply_markup=markup,
         )
 
-    if not file_id:
+    if cache_file_id:
+        # the file_id is needed, errors of the call fail the task here
+        message = sent.result()
         cache.add(
             cache_key_photo,
-            message.photo[-1].file_id, timedelta(minutes=30),
+            message.photo[-1].file_id, PHOTO_FILE_ID_TTL,
         )
+    else:
+        log_failure(sent)
+
+    if not edit and settings.PHOTO_STORAGE_CHAT_ID and cars_count > 1:
+        prefetch_photos.delay([
+            other.thumb_url
+            for i, other in enumerate(result.cars)
+            if i != page
+        ])
+
+
+@app.task(
+    ignore_result=True,
+    soft_time_limit=TASKS_TIME_LIMIT * 4,
+)
+def prefetch_photos(urls):
+    """Upload photos of the other result pages to the storage chat
+
+    Their file_ids are cached, so switching pages doesn't download
+    and upload photos anymore.
+    """
+    file_ids = cache.get_many([get_photo_cache_key(url) for url in urls])
+    urls = [url for url, file_id in zip(urls, file_ids) if not file_id]
+    if not urls:
+        return
+
+    async def load_photos():
+        return await asyncio.gather(
+            *[avtonomer.async_load_photo(url) for url in urls],
+            return_exceptions=True,
+        )
+
+    sent = {}
+    for url, photo in zip(urls, asyncio.run(load_photos())):
+        if isinstance(photo, Exception):
+            logger.warning(f"Failed to prefetch {url}: {photo}")
+            continue
+        if not photo:
+            continue
+        sent[url] = sender.send_photo(
+            settings.PHOTO_STORAGE_CHAT_ID, photo,
+            disable_notification=True,
+        )
+
+    uploaded = {}
+    try:
+        for url, future in sent.items():
+            try:
+                message = future.result()
+            except telegram.error.TelegramError as exc:
+                logger.warning(f"Failed to upload {url}: {exc!r}")
+                continue
+            uploaded[get_photo_cache_key(url)] = message.photo[-1].file_id
+    finally:
+        cache.set_many(uploaded, PHOTO_FILE_ID_TTL)
 
 
 @app.task(
@@ -146,12 +411,14 @@ def an_paginated_search(
     bind=True,
     autoretry_for=(RequestException, ),
     retry_kwargs={"max_retries": 2},
-    default_retry_delay=2,
+    retry_backoff=2,
+    retry_jitter=True,
     soft_time_limit=TASKS_TIME_LIMIT,
 )
 @use_translation
-def an_listed_search(self, chat_id, message_id, search_query_id):
-    search_query = db.get_search_query(search_query_id)
+def an_listed_search(self, chat_id, message_id, search_query_id,
+                     month=None):
+    search_query = db.get_search_query(search_query_id, month)
     lp_num = search_query.query_text
     lp_type = search_query.num_type
 
@@ -160,31 +427,43 @@ def an_listed_search(self, chat_id, message_id, search_query_id):
 
     cache_key = f"an_listed_search-{lp_type}-{lp_num}"
 
-    result = cache.get(cache_key)
-    if not result:
-        result = plate_format.search(lp_num)
+    result = search_cached(cache_key, plate_format, lp_num)
 
     if result is None:
         logger.warning(f"No data for query {lp_type} {lp_num}")
-        bot.send_message(
+        log_failure(sender.send_message(
             chat_id, plate_format.msg_no_data(),
             reply_to_message_id=message_id,
-        )
+        ))
         return
 
-    cache.add(cache_key, result, timedelta(minutes=5))
-
     message = (
         plate_format.msg_with_results(lp_num, result)
         if result.total_results > 0
         else plate_format.msg_no_results(lp_num)
     )
-    bot.send_message(
+    log_failure(sender.send_message(
         chat_id,
         message,
         parse_mode="Markdown",
         reply_to_message_id=message_id,
-    )
+    ))
+
+
+@app.task(
+    ignore_result=True,
+    soft_time_limit=TASKS_TIME_LIMIT,
+)
+def refresh_search(cache_key, lp_type, lp_num):
+    from avbot.plate_formats import get_plate_format_by_type
+    plate_format = get_plate_format_by_type(lp_type)
+    try:
+        result = plate_format.search(lp_num)
+    except UpstreamUnavailable as exc:
+        logger.warning(f"Refresh of {lp_num} skipped: {exc}")
+        return
+    if result is not None:
+        cache.add(cache_key, result, *get_search_result_ttl(result))
 
 
 @app.task(
@@ -200,15 +479,29 @@ def vin_get_info(self, chat_id, message_id, vin, user_id):
     result = vininfo.get_vin_info(vin)
     if not result:
         if settings.FWD_CHAT_ID:
-            msg = bot.forward_message(settings.FWD_CHAT_ID, chat_id, message_id)
-            key = f"forwarding-{msg.message_id}"
-            cache.add(key, message_id, time=timedelta(minutes=60))
+            msg = sender.forward_message(
+                settings.FWD_CHAT_ID, chat_id, message_id).result()
+            cache.add(
+                f"forwarding-{msg.message_id}", message_id,
+                time=timedelta(minutes=60),
+            )
     else:
         user = db.get_user_by_id(user_id)
         db.add_search_query(user, vin, "vin")
         message = vininfo.format_msg(result)
-        bot.send_message(
+        log_failure(sender.send_message(
             chat_id,
             message,
             reply_to_message_id=message_id,
-        )
+        ))
+
+
+@app.task(ignore_result=True)
+def maintain_partitions():
+    partitions.maintain_partitions(
+        db.engine,
+        datetime.utcnow(),
+        settings.DB_PARTITIONS_AHEAD,
+        settings.DB_RETENTION_MONTHS,
+        settings.DB_RETENTION_DROP,
+    )
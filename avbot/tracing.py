@@ -0,0 +1,133 @@
+"""Correlation ids and per-stage timing spans
+
+A correlation id is created for every update and passed to the tasks in
+their headers. Spans of an update or a task are logged and saved to Redis
+at its end, so stages of a search can be looked up by search query id.
+"""
+import contextvars
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from avbot import settings
+
+logger = logging.getLogger(__name__)
+
+_redis = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL)
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_buffer = contextvars.ContextVar("trace_buffer", default=None)
+
+
+def _trace_key(correlation_id):
+    return f"trace:{correlation_id}"
+
+
+def _search_query_key(search_query_id):
+    return f"trace:search_query:{search_query_id}"
+
+
+def start_trace(correlation_id=None):
+    """Start collecting spans of the current update or task"""
+    if not settings.TRACING:
+        return None
+    correlation_id = correlation_id or uuid.uuid4().hex[:16]
+    _correlation_id.set(correlation_id)
+    _buffer.set({"spans": [], "search_query_ids": []})
+    return correlation_id
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+def add_span(stage, duration, correlation_id=None, **fields):
+    """Record stage which took duration seconds and has just finished
+
+    Spans of other traces (given correlation_id) are saved at once.
+    """
+    buffer = _buffer.get() if correlation_id is None else None
+    correlation_id = correlation_id or _correlation_id.get()
+    if correlation_id is None:
+        return
+    item = {
+        "stage": stage,
+        "at": round(time.time() - duration, 3),
+        "ms": round(duration * 1000, 2),
+        **fields,
+    }
+    logger.debug(json.dumps({"correlation_id": correlation_id, **item}))
+    if buffer is not None:
+        buffer["spans"].append(item)
+    else:
+        _save(correlation_id, [item], [])
+
+
+@contextmanager
+def span(stage, **fields):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(stage, time.perf_counter() - start, **fields)
+
+
+def link_search_query(search_query_id):
+    """Make the current trace found by search_query_id"""
+    buffer = _buffer.get()
+    if buffer is not None:
+        buffer["search_query_ids"].append(search_query_id)
+
+
+def end_trace():
+    """Save collected spans of the current trace and stop it"""
+    buffer = _buffer.get()
+    correlation_id = _correlation_id.get()
+    _correlation_id.set(None)
+    _buffer.set(None)
+    if buffer is None or correlation_id is None:
+        return
+    _save(correlation_id, buffer["spans"], buffer["search_query_ids"])
+
+
+def _save(correlation_id, spans, search_query_ids):
+    if not spans and not search_query_ids:
+        return
+    pipe = _redis.pipeline(transaction=False)
+    if spans:
+        key = _trace_key(correlation_id)
+        pipe.rpush(key, *[json.dumps(item) for item in spans])
+        pipe.expire(key, settings.TRACE_TTL)
+    for search_query_id in search_query_ids:
+        key = _search_query_key(search_query_id)
+        pipe.rpush(key, correlation_id)
+        pipe.expire(key, settings.TRACE_TTL)
+    try:
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        logger.exception(f"Failed to save trace {correlation_id}")
+
+
+def get_traces(search_query_id):
+    """Return [(correlation_id, spans sorted by start)] of search query"""
+    correlation_ids = [
+        correlation_id.decode("utf-8")
+        for correlation_id in _redis.lrange(
+            _search_query_key(search_query_id), 0, -1)
+    ]
+    if not correlation_ids:
+        return []
+    pipe = _redis.pipeline(transaction=False)
+    for correlation_id in correlation_ids:
+        pipe.lrange(_trace_key(correlation_id), 0, -1)
+    return [
+        (
+            correlation_id,
+            sorted((json.loads(item) for item in items),
+                   key=lambda item: item["at"]),
+        )
+        for correlation_id, items in zip(correlation_ids, pipe.execute())
+    ]
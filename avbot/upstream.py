@@ -0,0 +1,206 @@
+"""Cluster-wide guards of upstream requests
+
+The state is kept in Redis, so all bot and worker processes share one
+request rate limit and one circuit breaker per upstream.
+"""
+import logging
+import time
+
+import redis
+from requests.exceptions import RequestException
+
+from avbot import metrics, settings, tracing
+
+FAILURE_STATUS_CODES = {403, 429, 500, 502, 503, 504, 520, 521, 522, 524}
+
+# tokens are refilled on every call, the time is taken from Redis to not
+# depend on clocks of the workers. ARGV holds rate and burst of every key,
+# a token is taken from all buckets or, if one of them is empty, from none
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call("HMGET", key, "tokens", "ts")
+    local value = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    value = math.min(burst, value + math.max(0, now - ts) * rate)
+    if value < 1 then
+        wait = math.max(wait, (1 - value) / rate)
+    end
+    tokens[i] = value
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call("HSET", key, "tokens", tostring(tokens[i]), "ts", tostring(now))
+    redis.call("EXPIRE", key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+
+logger = logging.getLogger(__name__)
+
+_redis = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL)
+
+
+class UpstreamUnavailable(Exception):
+    """Upstream is throttled or its circuit breaker is open"""
+
+
+class TokenBucket:
+
+    def __init__(self, name, rate, burst):
+        self.key = f"upstream:{name}:tokens"
+        self.rate = rate
+        self.burst = burst
+        self._script = _redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, *others):
+        """Take a token if available, else return seconds to wait for it
+
+        With other buckets the token is taken from all of them or, if one
+        has to be waited for, from none.
+        """
+        buckets = [bucket for bucket in (self, *others) if bucket.rate]
+        if not buckets:
+            return 0
+        args = []
+        for bucket in buckets:
+            args += [bucket.rate, bucket.burst]
+        return float(self._script(
+            keys=[bucket.key for bucket in buckets], args=args))
+
+    def acquire(self, timeout):
+        """Take a token, wait at most timeout seconds for it"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stop requests after threshold failures within window seconds
+
+    After cooldown seconds the breaker is half-open and lets one probe
+    request through, its result closes or opens the breaker again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold, window, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._failures_key = f"upstream:{name}:failures"
+        self._open_key = f"upstream:{name}:open"
+        self._tripped_key = f"upstream:{name}:tripped"
+        self._probe_key = f"upstream:{name}:probe"
+
+    def _get_flags(self):
+        pipe = _redis.pipeline(transaction=False)
+        pipe.exists(self._open_key)
+        pipe.exists(self._tripped_key)
+        return pipe.execute()
+
+    def get_state(self):
+        is_open, is_tripped = self._get_flags()
+        if is_open:
+            return self.OPEN
+        if is_tripped:
+            return self.HALF_OPEN
+        return self.CLOSED
+
+    def allow(self):
+        is_open, is_tripped = self._get_flags()
+        if is_open:
+            return False
+        if is_tripped:
+            # only one probe at a time while half-open
+            return bool(_redis.set(
+                self._probe_key, 1, nx=True,
+                ex=int(settings.AN_READ_TIMEOUT) + 1,
+            ))
+        return True
+
+    def record_success(self):
+        if _redis.delete(self._tripped_key):
+            logger.warning(f"Circuit breaker {self.name} is closed")
+            _redis.delete(self._failures_key, self._probe_key)
+
+    def record_failure(self):
+        pipe = _redis.pipeline(transaction=False)
+        pipe.incr(self._failures_key)
+        pipe.expire(self._failures_key, self.window)
+        pipe.exists(self._tripped_key)
+        failures, _, is_tripped = pipe.execute()
+        if is_tripped or failures >= self.threshold:
+            self.trip()
+
+    def trip(self):
+        logger.warning(
+            f"Circuit breaker {self.name} is open for {self.cooldown}s")
+        pipe = _redis.pipeline()
+        pipe.setex(self._open_key, self.cooldown, 1)
+        pipe.set(self._tripped_key, 1)
+        pipe.delete(self._failures_key, self._probe_key)
+        pipe.execute()
+
+
+class Upstream:
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.bucket = TokenBucket(name, rate, burst)
+        self.breaker = CircuitBreaker(
+            name,
+            settings.AN_BREAKER_THRESHOLD,
+            settings.AN_BREAKER_WINDOW,
+            settings.AN_BREAKER_COOLDOWN,
+        )
+        metrics.add_breaker(self.breaker)
+
+    def get_state(self):
+        return self.breaker.get_state()
+
+    def _observe(self, status, start):
+        duration = time.perf_counter() - start
+        metrics.UPSTREAM_REQUEST_SECONDS.labels(self.name, status).observe(
+            duration)
+        tracing.add_span(
+            "upstream", duration, upstream=self.name, status=status)
+
+    def get(self, session, url, **kwargs):
+        """Do session.get guarded by the rate limiter and circuit breaker"""
+        if not self.breaker.allow():
+            metrics.UPSTREAM_REJECTED.labels(self.name, "breaker").inc()
+            raise UpstreamUnavailable(f"{self.name} circuit breaker is open")
+        if not self.bucket.acquire(settings.AN_RATE_LIMIT_WAIT):
+            metrics.UPSTREAM_REJECTED.labels(self.name, "throttled").inc()
+            raise UpstreamUnavailable(f"{self.name} is throttled")
+        start = time.perf_counter()
+        try:
+            resp = session.get(url, **kwargs)
+        except RequestException:
+            self._observe("error", start)
+            self.breaker.record_failure()
+            raise
+        self._observe(resp.status_code, start)
+        if resp.status_code in FAILURE_STATUS_CODES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
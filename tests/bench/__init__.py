@@ -0,0 +1,213 @@
+import pickle
+import timeit
+from types import SimpleNamespace
+
+from avbot import avtonomer, codec
+from avbot.cmd.ru import RuRegionInfoRequest, RuSeriesInfoRequest
+from avbot.i18n import setup_locale
+from avbot.plate_formats import PLATE_FORMATS, find_plate_formats, \
+    get_plate_format_by_type
+from avbot.tasks import get_car_caption
+
+FIXTURES = ("ru", "su", "us")
+QUERIES = (
+    "а123аа777", "a123   aa 123", "ан239936", "4197хк47", "нт005х77",
+    "аа12377", "с201799", "ru37", "ааа777", "ж8028ХА", "aa-123-aa",
+    "123abc11", "01a123bc", "ka1234hc", "ny abc", "hello world",
+)
+
+# stages are compared relative to this one measured in the same run, so
+# baselines don't depend on the speed of the machine
+REFERENCE_STAGE = "reference"
+
+STAGES = {}
+
+
+def stage(name):
+    def decorator(func):
+        STAGES[name] = func
+        return func
+    return decorator
+
+
+def load_fixture(name):
+    with open(f"tests/{name}_fastsearch.html", "r") as f:
+        return f.read()
+
+
+def fake_response(text):
+    return SimpleNamespace(text=text, raise_for_status=lambda: None)
+
+
+@stage(REFERENCE_STAGE)
+def bench_reference():
+    data = [str(i) for i in range(1000, 0, -1)]
+
+    def run():
+        sorted(data)
+        "".join(data).upper()
+    return run
+
+
+@stage("validate")
+def bench_validate():
+    plates = [plate for plates in PLATE_FORMATS.values() for plate in plates]
+
+    def run():
+        for query in QUERIES:
+            for plate in plates:
+                plate.validate(query)
+    return run
+
+
+@stage("validate-registry")
+def bench_validate_registry():
+    def run():
+        for query in QUERIES:
+            find_plate_formats(query)
+    return run
+
+
+@stage("lookup-by-type")
+def bench_lookup_by_type():
+    num_types = [
+        plate.num_type for plates in PLATE_FORMATS.values()
+        for plate in plates
+    ]
+
+    def run():
+        for num_type in num_types:
+            get_plate_format_by_type(num_type)
+    return run
+
+
+def make_parse_stage(fixture, parser):
+    def bench_parse():
+        resp = fake_response(load_fixture(fixture))
+
+        def run():
+            default_parser = avtonomer.settings.AN_PARSER
+            avtonomer.settings.AN_PARSER = parser
+            try:
+                avtonomer.parse_search_results(resp)
+            finally:
+                avtonomer.settings.AN_PARSER = default_parser
+        return run
+    return bench_parse
+
+
+for _fixture in FIXTURES:
+    for _parser in avtonomer.PARSERS:
+        stage(f"parse-{_parser}-{_fixture}")(make_parse_stage(_fixture, _parser))
+
+
+@stage("render-caption")
+def bench_render_caption():
+    result = avtonomer.parse_cars_bs4(load_fixture("ru"))
+
+    def run():
+        for page, car in enumerate(result):
+            get_car_caption(car, "а123аа777", page, len(result))
+    return run
+
+
+@stage("render-listed")
+def bench_render_listed():
+    setup_locale("en")
+    cars = avtonomer.parse_cars_bs4(load_fixture("ru"))
+    result = avtonomer.AvSearchResult(len(cars), cars)
+
+    def run():
+        RuSeriesInfoRequest.msg_with_results("a37aa", result)
+        RuRegionInfoRequest.msg_with_results("ru37", result)
+    return run
+
+
+@stage("cache-pickle")
+def bench_cache_pickle():
+    cars = avtonomer.parse_cars_bs4(load_fixture("ru"))
+    result = avtonomer.AvSearchResult(len(cars), cars)
+
+    def run():
+        pickle.loads(pickle.dumps(result))
+    return run
+
+
+@stage("cache-codec")
+def bench_cache_codec():
+    cars = avtonomer.parse_cars_bs4(load_fixture("ru"))
+    result = avtonomer.AvSearchResult(len(cars), cars)
+
+    def run():
+        codec.loads(codec.dumps(result))
+    run.info = {
+        "bytes": len(codec.dumps(result)),
+        "pickle_bytes": len(pickle.dumps(result)),
+    }
+    return run
+
+
+@stage("cache-hit-pickle")
+def bench_cache_hit_pickle():
+    cars = avtonomer.parse_cars_bs4(load_fixture("ru"))
+    data = pickle.dumps(avtonomer.AvSearchResult(len(cars), cars))
+
+    def run():
+        pickle.loads(data)
+    return run
+
+
+@stage("cache-hit-codec")
+def bench_cache_hit_codec():
+    cars = avtonomer.parse_cars_bs4(load_fixture("ru"))
+    data = codec.dumps(avtonomer.AvSearchResult(len(cars), cars))
+
+    def run():
+        codec.loads(data)
+    return run
+
+
+def measure(func, repeat=5):
+    """Return the best time of one call of func in microseconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def run_stages(names=None, repeat=5):
+    results = {}
+    for name, setup in STAGES.items():
+        if names and name not in names and name != REFERENCE_STAGE:
+            continue
+        try:
+            func = setup()
+            func()
+        except ImportError as e:
+            results[name] = {"skipped": str(e)}
+            continue
+        results[name] = {"us_per_call": round(measure(func, repeat), 3)}
+        results[name].update(getattr(func, "info", {}))
+    reference = results[REFERENCE_STAGE]["us_per_call"]
+    for result in results.values():
+        if "us_per_call" in result:
+            result["relative"] = round(result["us_per_call"] / reference, 3)
+    return results
+
+
+def get_baseline(results):
+    return {
+        name: {"relative": result["relative"]}
+        for name, result in results.items()
+        if name != REFERENCE_STAGE and "relative" in result
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Return stages slower than baseline, both relative to the reference"""
+    regressions = {}
+    for name, result in results.items():
+        base = baseline.get(name, {}).get("relative")
+        current = result.get("relative")
+        if base and current and current > base * tolerance:
+            regressions[name] = (base, current)
+    return regressions
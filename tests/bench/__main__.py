@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+
+from tests.bench import (
+    REFERENCE_STAGE, find_regressions, get_baseline, run_stages,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.bench",
+        description="Benchmark validate, parse, render and cache stages",
+    )
+    parser.add_argument("stages", nargs="*", help="stages to run, all by default")
+    parser.add_argument("-o", "--output", help="write results as JSON to file")
+    parser.add_argument("-b", "--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "-t", "--tolerance", type=float, default=1.5,
+        help=(
+            "fail when a stage is slower than baseline * tolerance, "
+            f"both relative to the {REFERENCE_STAGE} stage"
+        ),
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--update-baseline", action="store_true",
+        help="store results as the new baseline",
+    )
+    args = parser.parse_args()
+
+    results = run_stages(args.stages, args.repeat)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(get_baseline(results), f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for name, (base, current) in sorted(regressions.items()):
+        print(
+            f"REGRESSION {name}: {current:.2f} > {base:.2f} "
+            f"* {args.tolerance} times {REFERENCE_STAGE}",
+            file=sys.stderr,
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
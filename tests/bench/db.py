@@ -0,0 +1,138 @@
+"""Seed synthetic users and queries and compare lookups with/without indexes
+
+Usage: python -m tests.bench.db --database-url postgresql://... --reset
+
+The database is dropped and recreated from models, use a scratch one.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from avbot import models, partitions
+
+LOOKUPS = {
+    "user_by_telegram_id":
+        'SELECT * FROM "user" WHERE telegram_id = :telegram_id',
+    "search_queries_by_user":
+        "SELECT * FROM search_query WHERE user_id = :user_id",
+    "search_query_by_id":
+        "SELECT * FROM search_query WHERE id = :search_query_id",
+    "inline_queries_by_search_query":
+        "SELECT * FROM inline_query WHERE search_query_id = :search_query_id",
+}
+
+
+def seed(conn, users, searches, inlines):
+    conn.execute(text("""
+        INSERT INTO "user" (telegram_id, first_name, language_code, created_at)
+        SELECT 100000 + g, 'user' || g, 'ru', now() - g * interval '1 minute'
+        FROM generate_series(1, :n) g
+    """), {"n": users})
+    conn.execute(text("""
+        INSERT INTO search_query (user_id, query_text, num_type, created_at)
+        SELECT 1 + (random() * (:users - 1))::int, 'a' || g || 'aa77', 'ru',
+               now() - g * interval '1 second'
+        FROM generate_series(1, :n) g
+    """), {"n": searches, "users": users})
+    conn.execute(text("""
+        INSERT INTO inline_query (search_query_id, query, created_at)
+        SELECT 1 + (random() * (:searches - 1))::int, '1',
+               now() - g * interval '1 second'
+        FROM generate_series(1, :n) g
+    """), {"n": inlines, "searches": searches})
+    conn.execute(text("ANALYZE"))
+
+
+def measure(conn, users, searches, samples):
+    results = {}
+    for name, query in LOOKUPS.items():
+        params = {
+            "telegram_id": 100000 + random.randint(1, users),
+            "user_id": random.randint(1, users),
+            "search_query_id": random.randint(1, searches),
+        }
+        plan = conn.execute(
+            text("EXPLAIN ANALYZE " + query), params).scalars().all()
+        timings = []
+        for _ in range(samples):
+            params = {
+                "telegram_id": 100000 + random.randint(1, users),
+                "user_id": random.randint(1, users),
+                "search_query_id": random.randint(1, searches),
+            }
+            start = time.perf_counter()
+            conn.execute(text(query), params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = {
+            "plan": plan,
+            "p50_ms": round(timings[len(timings) // 2], 3),
+            "p95_ms": round(timings[int(len(timings) * 0.95)], 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.bench.db")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument(
+        "--reset", action="store_true",
+        help="drop and recreate all tables, required",
+    )
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--searches", type=int, default=2000000)
+    parser.add_argument("--inlines", type=int, default=1000000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("--reset is required, all tables will be dropped")
+
+    engine = create_engine(args.database_url)
+    indexes = [
+        index
+        for table in models.Base.metadata.sorted_tables
+        for index in table.indexes
+    ]
+    with engine.begin() as conn:
+        models.Base.metadata.drop_all(conn)
+        models.Base.metadata.create_all(conn)
+        now = datetime.utcnow()
+        for table in partitions.PARTITIONED_TABLES:
+            partitions.create_partitions(
+                conn, table, partitions.add_months(now, -2), 4)
+        for index in indexes:
+            index.drop(conn)
+        seed(conn, args.users, args.searches, args.inlines)
+
+    results = {}
+    with engine.connect() as conn:
+        results["before"] = measure(
+            conn, args.users, args.searches, args.samples)
+    with engine.begin() as conn:
+        for index in indexes:
+            index.create(conn)
+        conn.execute(text("ANALYZE"))
+    with engine.connect() as conn:
+        results["after"] = measure(
+            conn, args.users, args.searches, args.samples)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for name in LOOKUPS:
+        before = results["before"][name]["p50_ms"]
+        after = results["after"][name]["p50_ms"]
+        print(f"{name}: p50 {before} ms -> {after} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Feed synthetic updates into the dispatcher and report updates/sec
+
+Usage: python -m tests.bench.dispatch --updates 2000 --shards 1 4 8
+
+Handlers sleep instead of doing real DB queries and task enqueues, like
+the bot registers them: preprocess (group 0), search (group 1) and
+postprocess (group 2).
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from queue import Queue
+from unittest.mock import MagicMock
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Filters, MessageHandler, TypeHandler
+
+from avbot.dispatcher import ShardedDispatcher
+
+
+def make_updates(count, users):
+    return [
+        Update(i, message=Message(
+            i, datetime.utcnow(),
+            chat=Chat(100000 + i % users, Chat.PRIVATE),
+            from_user=User(100000 + i % users, "user", False),
+            text="a123aa77",
+        ))
+        for i in range(count)
+    ]
+
+
+def measure(shards, updates, db_latency, enqueue_latency):
+    done = threading.Semaphore(0)
+    seen = {}
+    ordered = True
+
+    def on_preprocess_update(update, context):
+        time.sleep(db_latency)
+
+    def on_search_query(update, context):
+        nonlocal ordered
+        time.sleep(db_latency + enqueue_latency)
+        user_id = update.effective_user.id
+        if seen.get(user_id, -1) > update.update_id:
+            ordered = False
+        seen[user_id] = update.update_id
+
+    def on_postprocess_update(update, context):
+        done.release()
+
+    dp = ShardedDispatcher(
+        MagicMock(defaults=None), Queue(), shards=shards, workers=1)
+    dp.add_handler(MessageHandler(Filters.update, on_preprocess_update), 0)
+    dp.add_handler(MessageHandler(Filters.text, on_search_query), 1)
+    dp.add_handler(TypeHandler(Update, on_postprocess_update), 2)
+    thread = threading.Thread(target=dp.start, daemon=True)
+    thread.start()
+
+    start = time.perf_counter()
+    for update in updates:
+        dp.update_queue.put(update)
+    for _ in updates:
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    dp.stop()
+    thread.join()
+    return {
+        "updates_per_sec": round(len(updates) / elapsed, 1),
+        "ordered": ordered,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.bench.dispatch")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument(
+        "--db-latency", type=float, default=0.002,
+        help="seconds a DB query takes",
+    )
+    parser.add_argument(
+        "--enqueue-latency", type=float, default=0.001,
+        help="seconds a task enqueue takes",
+    )
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.users)
+    results = {
+        shards: measure(
+            shards, updates, args.db_latency, args.enqueue_latency)
+        for shards in args.shards
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for shards, result in results.items():
+        print(
+            f"{shards} shards: {result['updates_per_sec']} updates/sec",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
-from unittest.mock import patch
+import asyncio
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
 
 from avbot import avtonomer
 from avbot.cmd.us import UsSeriesInfoRequest
 
 
+@pytest.fixture(autouse=True)
+def open_upstream(monkeypatch):
+    for upstream in (avtonomer.upstream, avtonomer.photo_upstream):
+        monkeypatch.setattr(upstream, "breaker", MagicMock())
+        monkeypatch.setattr(upstream, "bucket", MagicMock())
+
+
 @patch("avbot.avtonomer.scraper.get")
 def test_search_ru_is_success(mockget):
     with open("tests/ru_fastsearch.html", "r") as f:
@@ -59,3 +70,30 @@ def test_series_us_url():
     assert "https://platesmania.com/us/gallery.php?gal=us&region=7535&ctype=71&nomer=rbb+%2A" == url
     url = UsSeriesInfoRequest.get_series_us_url("ga", "asd")
     assert "https://platesmania.com/us/gallery.php?gal=us&region=7510&ctype=91&nomer=asd%2A" == url
+
+
+@pytest.mark.parametrize("parser", ["lxml", "stream"])
+@pytest.mark.parametrize("fixture", ["ru", "su", "us"])
+def test_parsers_give_same_cars_as_bs4(parser, fixture):
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+    with open(f"tests/{fixture}_fastsearch.html", "r") as f:
+        data = f.read()
+    expected = avtonomer.parse_cars_bs4(data)
+    assert avtonomer.PARSERS[parser](data) == expected
+
+
+def test_parse_date():
+    assert avtonomer.parse_date(" 2021-04-07 22:43:34 ") == \
+        datetime(2021, 4, 7, 22, 43, 34)
+    assert avtonomer.parse_date("Apr 7 2021") == datetime(2021, 4, 7)
+
+
+@patch("avbot.avtonomer.photo_scraper.get")
+def test_load_photo_uses_photo_pool_with_timeout(mockget):
+    mockget.return_value.status_code = 200
+    mockget.return_value.content = b"jpeg"
+    photo = asyncio.run(avtonomer.async_load_photo("https://img03/1.jpg"))
+    assert photo.read() == b"jpeg"
+    mockget.assert_called_once_with(
+        "https://img03/1.jpg", timeout=avtonomer.TIMEOUT)
@@ -0,0 +1,23 @@
+from avbot import settings
+from tests.bench import STAGES, find_regressions
+
+
+def test_bench_stages_run():
+    for name in ("validate", "render-caption", "cache-pickle"):
+        STAGES[name]()()
+
+
+def test_find_regressions():
+    baseline = {"a": {"relative": 10.0}, "b": {"relative": 10.0}}
+    results = {
+        "a": {"relative": 14.0},
+        "b": {"relative": 16.0},
+        "c": {"relative": 1.0},
+    }
+    assert find_regressions(results, baseline, 1.5) == {"b": (10.0, 16.0)}
+
+
+def test_parse_stage_restores_parser():
+    default_parser = settings.AN_PARSER
+    STAGES["parse-stream-ru"]()()
+    assert settings.AN_PARSER == default_parser
@@ -0,0 +1,38 @@
+from unittest.mock import patch
+
+from avbot import bloom
+
+
+def test_filter_size():
+    bits, hashes = bloom.get_filter_size(1000, 0.01)
+    assert 9000 < bits < 10000
+    assert hashes == 7
+
+
+@patch("avbot.bloom._redis")
+def test_lookup_checks_every_slice_of_live_generations(mockredis):
+    index = bloom.NegativeIndex("ru", 10, 0.01, 60, 2)
+    mockredis.mget.return_value = [b"15", None, None]
+    _, first_hashes = index.get_slice_size(0)
+    _, second_hashes = index.get_slice_size(1)
+    pipe = mockredis.pipeline.return_value
+    pipe.execute.return_value = [0] * first_hashes + [1] * second_hashes
+
+    assert "a123aa77" in index
+    assert pipe.getbit.call_count == first_hashes + second_hashes
+
+
+def test_slices_share_error_rate():
+    index = bloom.NegativeIndex("ru", 1000, 0.01, 60, 4)
+    bits = [index.get_slice_size(i)[0] for i in range(3)]
+    assert bits[0] == bloom.get_filter_size(1000, 0.01 / 8)[0]
+    assert bits[0] < bits[1] < bits[2]
+
+
+@patch("avbot.bloom._redis")
+def test_discarded_item_is_not_reported(mockredis):
+    index = bloom.NegativeIndex("ru", 10, 0.01, 60, 2)
+    mockredis.mget.return_value = [b"1", None, b"1"]
+
+    assert "a123aa77" not in index
+    mockredis.pipeline.assert_not_called()
@@ -0,0 +1,128 @@
+import pickle
+from unittest.mock import MagicMock, patch
+
+from avbot import cache
+
+
+@patch("avbot.cache.add")
+@patch("avbot.cache.get", return_value=None)
+@patch("avbot.cache._cache")
+def test_single_flight_leader_computes_value(mockredis, mockget, mockadd):
+    mockredis.lock.return_value.acquire.return_value = True
+    func = MagicMock(return_value="result")
+    assert cache.single_flight("key", func, 60) == "result"
+    func.assert_called_once()
+    mockadd.assert_called_once_with("key", "result", 60, None)
+    mockredis.lock.return_value.release.assert_called_once()
+
+
+@patch("avbot.cache.add")
+@patch("avbot.cache.get", return_value=None)
+@patch("avbot.cache._cache")
+def test_single_flight_waiter_gets_leader_value(mockredis, mockget, mockadd):
+    mockredis.lock.return_value.acquire.return_value = False
+    mockredis.mget.side_effect = [
+        [None, b"token"],
+        [pickle.dumps("result"), b"token"],
+    ]
+    func = MagicMock()
+    assert cache.single_flight("key", func, 60) == "result"
+    func.assert_not_called()
+    mockadd.assert_not_called()
+
+
+@patch("avbot.cache.SINGLE_FLIGHT_POLL_INTERVAL", 0.01)
+@patch("avbot.cache.get", return_value=None)
+@patch("avbot.cache._cache")
+def test_single_flight_waiter_never_computes_while_leased(mockredis, mockget):
+    mockredis.lock.return_value.acquire.return_value = False
+    mockredis.mget.return_value = [None, b"token"]
+    func = MagicMock()
+    assert cache.single_flight(
+        "key", func, 60, lock_timeout=0.1, wait_timeout=0) is None
+    func.assert_not_called()
+    assert mockredis.mget.call_count > 1
+
+
+@patch("avbot.cache._cache")
+def test_get_stale_value_is_served_and_revalidated(mockredis):
+    pipe = mockredis.pipeline.return_value
+    pipe.execute.return_value = [pickle.dumps("stale"), 0]
+    mockredis.set.return_value = True
+    revalidate = MagicMock()
+    assert cache.get("key", revalidate) == "stale"
+    revalidate.assert_called_once()
+
+
+@patch("avbot.cache._cache")
+def test_get_miss_sets_no_revalidation_marker(mockredis):
+    pipe = mockredis.pipeline.return_value
+    pipe.execute.return_value = [None, 0]
+    revalidate = MagicMock()
+    assert cache.get("key", revalidate) is None
+    mockredis.set.assert_not_called()
+    revalidate.assert_not_called()
+
+
+@patch("avbot.cache._cache")
+def test_get_fresh_value_is_not_revalidated(mockredis):
+    pipe = mockredis.pipeline.return_value
+    pipe.execute.return_value = [pickle.dumps("fresh"), 1]
+    revalidate = MagicMock()
+    assert cache.get("key", revalidate) == "fresh"
+    revalidate.assert_not_called()
+
+
+def test_local_cache_evicts_least_recently_used():
+    local = cache.LocalCache(maxsize=2, ttl=60)
+    local.set("a", 1)
+    local.set("b", 2)
+    assert local.get("a") == 1
+    local.set("c", 3)
+    assert local.get("b") is None
+    assert local.get("a") == 1
+    assert local.get("c") == 3
+
+
+@patch("avbot.cache._time.monotonic", side_effect=[0, 0, 100])
+def test_local_cache_expires_entries(mocktime):
+    local = cache.LocalCache(maxsize=2, ttl=60)
+    local.set("a", 1)
+    assert local.get("a") == 1
+    assert local.get("a") is None
+
+
+@patch("avbot.cache._cache")
+def test_get_many_and_set_many(mockredis):
+    mockredis.mget.return_value = [cache.codec.dumps("file-id"), None]
+    assert cache.get_many(["a", "b"]) == ["file-id", None]
+    mockredis.mget.assert_called_once_with([b"k:a", b"k:b"])
+
+    cache.set_many({"a": "1", "b": "2"}, 60)
+    pipe = mockredis.pipeline.return_value
+    assert pipe.setex.call_count == 2
+    pipe.execute.assert_called_once()
+
+
+@patch("avbot.cache._listener_token", "test")
+@patch("avbot.cache._ensure_listener")
+@patch("avbot.cache._local", cache.LocalCache(maxsize=10, ttl=10))
+@patch("avbot.cache._cache")
+def test_local_tier_serves_repeated_gets(mockredis, mocklistener):
+    mockredis.get.return_value = cache.codec.dumps("file-id")
+    assert cache.get("key") == "file-id"
+    assert cache.get("key") == "file-id"
+    mockredis.get.assert_called_once()
+
+    cache.delete("key")
+    mockredis.pipeline.return_value.publish.assert_called_once()
+    assert cache.get("key") == "file-id"
+    assert mockredis.get.call_count == 2
+
+
+def test_key_family():
+    assert cache._get_family(cache._key("an_paginated_search-ru-a1")) == \
+        "an_paginated_search"
+    assert cache._get_family(cache._key("avtonomer.load_photo(1.jpg)")) == \
+        "avtonomer.load_photo"
+    assert cache._get_family(cache._key([(1, ), {}])) == "func"
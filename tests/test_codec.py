@@ -0,0 +1,47 @@
+import pickle
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from avbot import avtonomer, codec
+
+
+@pytest.mark.parametrize("fixture", ["ru", "su", "us"])
+def test_search_result_roundtrip(fixture):
+    with open(f"tests/{fixture}_fastsearch.html", "r") as f:
+        cars = avtonomer.parse_cars_bs4(f.read())
+    result = avtonomer.AvSearchResult(len(cars), cars)
+    data = codec.dumps(result)
+    assert codec.loads(data) == result
+    assert len(data) < len(pickle.dumps(result))
+
+
+def test_other_values_roundtrip():
+    assert codec.loads(codec.dumps("AgACAgIAAxkDAAIB")) == "AgACAgIAAxkDAAIB"
+    assert codec.loads(codec.dumps({"id": 1})) == {"id": 1}
+    assert codec.loads(pickle.dumps([1, 2])) == [1, 2]
+
+
+def test_unknown_version_is_a_miss():
+    data = bytearray(codec.dumps("file-id"))
+    data[1] = codec.VERSION + 1
+    assert codec.loads(bytes(data)) is None
+
+
+@pytest.mark.parametrize("date", [
+    datetime(2026, 3, 1, 12, 30, 15, 250),
+    datetime(1969, 12, 31, 23, 59, 59, 999999),
+    datetime(2026, 3, 1, 12, 30, tzinfo=timezone(timedelta(hours=3))),
+])
+def test_car_date_roundtrip(date):
+    car = avtonomer.AvCar("make", "model", date, "", "", "", "a123aa77")
+    result = codec.loads(codec.dumps(avtonomer.AvSearchResult(1, [car])))
+    assert result.cars[0].date == date
+    assert result.cars[0].date.tzinfo == date.tzinfo
+
+
+def test_long_fields_roundtrip():
+    car = avtonomer.AvCar(
+        "make", "x" * 70000, datetime(2026, 3, 1), "", "", "", "a123aa77")
+    result = avtonomer.AvSearchResult(1, [car])
+    assert codec.loads(codec.dumps(result)) == result
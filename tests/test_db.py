@@ -0,0 +1,131 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from avbot import cache, db, models
+
+
+@patch("avbot.db.cache")
+@patch("avbot.db.engine")
+def test_flush_write_behind_inserts_search_queries_first(mockengine, mockcache):
+    now = datetime.utcnow()
+    search_query = {
+        "id": 1, "user_id": 1, "query_text": "a123aa77", "num_type": "ru",
+        "created_at": now,
+    }
+    inline_query = {"search_query_id": 1, "query": "1", "created_at": now}
+    mockcache.pop_list.return_value = [
+        ("inline_query", inline_query),
+        ("search_query", search_query),
+    ]
+    conn = mockengine.begin.return_value.__enter__.return_value
+
+    assert db.flush_write_behind() == 2
+
+    tables = [call.args[0].table for call in conn.execute.call_args_list]
+    assert tables == [
+        models.SearchQuery.__table__, models.InlineQuery.__table__,
+    ]
+    mockcache.pop_list.assert_called_once_with(db.WRITE_BEHIND_KEY, 500)
+
+
+@patch("avbot.db.cache")
+@patch("avbot.db.engine")
+def test_flush_write_behind_retries_failing_rows(mockengine, mockcache):
+    now = datetime.utcnow()
+    good = ("inline_query", {"search_query_id": 1, "query": "1",
+                             "created_at": now})
+    bad = ("inline_query", {"search_query_id": 2, "query": "1",
+                            "created_at": now}, 4)
+    mockcache.pop_list.return_value = [good, bad]
+    conn = mockengine.begin.return_value.__enter__.return_value
+    error = IntegrityError("INSERT", {}, Exception())
+    conn.execute.side_effect = [error, None, error]
+
+    assert db.flush_write_behind() == 2
+
+    mockcache.push.assert_called_once_with(
+        db.WRITE_BEHIND_DEAD_KEY, ("inline_query", bad[1]))
+
+
+@patch("avbot.db.cache")
+@patch("avbot.db.engine")
+def test_flush_write_behind_keeps_rows_while_database_is_down(
+        mockengine, mockcache):
+    entry = ("inline_query", {"search_query_id": 1, "query": "1"})
+    mockcache.pop_list.return_value = [entry]
+    conn = mockengine.begin.return_value.__enter__.return_value
+    conn.execute.side_effect = OperationalError("INSERT", {}, Exception())
+
+    with pytest.raises(OperationalError):
+        db.flush_write_behind()
+
+    mockcache.push_front.assert_called_once_with(db.WRITE_BEHIND_KEY, entry)
+
+
+@patch("avbot.db.settings.DB_WRITE_BEHIND", True)
+@patch("avbot.db.cache")
+def test_get_search_query_returns_pending_row(mockcache):
+    mockcache.get.return_value = {
+        "id": 7, "user_id": 1, "query_text": "ru37", "num_type": "ru-region",
+        "created_at": datetime.utcnow(),
+    }
+    search_query = db.get_search_query(7)
+    assert search_query.id == 7
+    assert search_query.num_type == "ru-region"
+
+
+@patch("avbot.db.settings.DB_WRITE_BEHIND", False)
+def test_get_search_query_month_hint_limits_partition():
+    queries = []
+    with patch("sqlalchemy.orm.Query.first", autospec=True,
+               side_effect=queries.append):
+        db.get_search_query(7, "2612")
+    params = queries[0].statement.compile().params
+    assert list(params.values()) == [
+        7, datetime(2026, 12, 1), datetime(2027, 1, 1),
+    ]
+    assert db.get_search_query_month(
+        models.SearchQuery(created_at=datetime(2026, 12, 31))) == "2612"
+
+
+@patch("avbot.cache._ensure_listener")
+@patch("avbot.db.cache.get", return_value=None)
+@patch("avbot.db.cache.add")
+@patch("avbot.db.cache.delete")
+@patch("avbot.db.session")
+def test_get_user_is_cached_in_process(
+    mocksession, mockdelete, mockadd, mockget, mocklistener
+):
+    db.user_cache.clear()
+    mocksession.query.return_value.filter_by.return_value.first.return_value \
+        = models.User(id=1, telegram_id=42, language_code="ru", country=1)
+
+    assert db.get_user(42).language_code == "ru"
+    assert db.get_user(42).id == 1
+    mocksession.query.assert_called_once()
+
+    db.invalidate_user(42)
+    db.get_user(42)
+    assert mocksession.query.call_count == 2
+
+
+@patch("avbot.cache._ensure_listener")
+def test_user_cache_is_invalidated_by_other_process(mocklistener):
+    db.user_cache.clear()
+    db.user_cache.set("user-42", {"id": 1, "telegram_id": 42})
+
+    # invalidation of db.invalidate_user(42) published by another process
+    cache._handle_invalidation(b"other-process\nk:user-42", "this-process")
+
+    assert db.user_cache.get("user-42") is None
+
+
+@patch("avbot.cache._invalidation_message", return_value=b"message")
+@patch("avbot.cache._cache")
+def test_invalidate_user_publishes_invalidation(mockredis, mockmessage):
+    db.invalidate_user(42)
+    mockredis.pipeline.return_value.publish.assert_called_once_with(
+        cache.INVALIDATION_CHANNEL, b"message")
@@ -0,0 +1,38 @@
+import threading
+import time
+from queue import Queue
+from unittest.mock import MagicMock
+
+from telegram.ext import Filters, MessageHandler
+
+from avbot.dispatcher import ShardedDispatcher
+from tests.bench.dispatch import make_updates
+
+
+def test_updates_of_one_user_keep_order():
+    handled = []
+    dp = ShardedDispatcher(
+        MagicMock(defaults=None), Queue(), shards=4, workers=1)
+
+    def on_update(update, context):
+        # later updates of other users would overtake this one
+        time.sleep(0.01 if update.effective_user.id % 4 == 0 else 0)
+        handled.append(
+            (update.effective_user.id, update.update_id,
+             threading.current_thread().name))
+
+    dp.add_handler(MessageHandler(Filters.update, on_update))
+    thread = threading.Thread(target=dp.start, daemon=True)
+    thread.start()
+    for update in make_updates(40, 8):
+        dp.update_queue.put(update)
+    deadline = time.monotonic() + 5
+    while len(handled) < 40 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dp.stop()
+    thread.join()
+
+    for user_id in {user_id for user_id, _, _ in handled}:
+        update_ids = [u for i, u, _ in handled if i == user_id]
+        assert update_ids == sorted(update_ids)
+    assert len({name for _, _, name in handled}) == 4
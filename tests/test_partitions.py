@@ -0,0 +1,68 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from avbot import partitions
+
+
+def test_add_months():
+    assert partitions.add_months(datetime(2026, 11, 15), 2) == \
+        datetime(2027, 1, 1)
+    assert partitions.add_months(datetime(2026, 1, 31), -1) == \
+        datetime(2025, 12, 1)
+
+
+def test_partition_name_roundtrip():
+    name = partitions.partition_name("search_query", datetime(2026, 3, 1))
+    assert name == "search_query_p2026_03"
+    assert partitions.parse_partition_name("search_query", name) == \
+        datetime(2026, 3, 1)
+    assert partitions.parse_partition_name(
+        "search_query", "search_query_default") is None
+
+
+@patch("avbot.partitions.get_partitions", return_value=[
+    "search_query_default",
+    "search_query_p2026_01",
+    "search_query_p2026_02",
+    "search_query_p2026_03",
+])
+def test_detach_partitions_keeps_recent_ones(mockget):
+    conn = MagicMock()
+    detached = partitions.detach_partitions(
+        conn, "search_query", datetime(2026, 3, 1))
+    assert detached == ["search_query_p2026_01", "search_query_p2026_02"]
+    assert conn.execute.call_count == 2
+
+
+def test_create_partition_moves_rows_out_of_default_partition():
+    conn = MagicMock()
+    # partition is missing, default partition exists and has its rows
+    conn.execute.return_value.scalar.side_effect = [False, True, True]
+
+    partitions.create_partition(conn, "search_query", datetime(2026, 3, 1))
+
+    statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert statements[3:] == [
+        "ALTER TABLE search_query DETACH PARTITION search_query_default",
+        "CREATE TABLE search_query_p2026_03 PARTITION OF search_query "
+        "FOR VALUES FROM ('2026-03-01T00:00:00') TO ('2026-04-01T00:00:00')",
+        "INSERT INTO search_query_p2026_03 SELECT * FROM search_query_default "
+        "WHERE created_at >= '2026-03-01T00:00:00' "
+        "AND created_at < '2026-04-01T00:00:00'",
+        "DELETE FROM search_query_default "
+        "WHERE created_at >= '2026-03-01T00:00:00' "
+        "AND created_at < '2026-04-01T00:00:00'",
+        "ALTER TABLE search_query ATTACH PARTITION search_query_default "
+        "DEFAULT",
+    ]
+
+
+@patch("avbot.partitions.detach_partitions")
+@patch("avbot.partitions.create_partitions", side_effect=Exception)
+def test_retention_runs_when_creating_partitions_fails(mockcreate, mockdetach):
+    engine = MagicMock()
+
+    partitions.maintain_partitions(engine, datetime(2026, 3, 15), 3, 12, False)
+
+    assert mockdetach.call_count == len(partitions.PARTITIONED_TABLES)
+    assert engine.begin.call_count == 2 * len(partitions.PARTITIONED_TABLES)
@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from avbot.photo_cache import PhotoCache
+
+
+def test_photo_cache_stores_same_content_once(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_size=1024)
+    cache.store("https://img/1.jpg", b"photo")
+    cache.store("https://img/2.jpg", b"photo")
+    assert cache.open("https://img/1.jpg").read() == b"photo"
+    assert cache.open("https://img/2.jpg").read() == b"photo"
+    assert cache.open("https://img/3.jpg") is None
+    assert len(os.listdir(cache.blobs_path)) == 1
+
+
+def test_photo_cache_evicts_least_recently_used(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_size=10)
+    cache.store("old", b"123456")
+    cache.store("new", b"abcdef")
+    os.utime(os.path.realpath(cache._url_path("old")), (1, 1))
+    cache.evict()
+    assert cache.open("old") is None
+    assert cache.open("new").read() == b"abcdef"
+    assert len(os.listdir(cache.urls_path)) == 1
+
+
+def test_photo_cache_stores_same_url_from_threads(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_size=1024)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(
+            lambda i: cache.store("https://img/1.jpg", b"photo"), range(50)))
+    assert cache.open("https://img/1.jpg").read() == b"photo"
+    assert len(os.listdir(cache.urls_path)) == 1
+
+
+def test_photo_cache_eviction_skips_blobs_removed_meanwhile(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_size=10)
+    cache.store("old", b"123456")
+    cache.store("new", b"abcdef")
+    scandir = os.scandir
+
+    @contextmanager
+    def racing_scandir(path):
+        with scandir(path) as entries:
+            entries = list(entries)
+        if path == cache.blobs_path:
+            # another worker evicts the first blob before it is stat'ed
+            os.remove(entries[0].path)
+        yield entries
+
+    with patch("avbot.photo_cache.os.scandir", racing_scandir):
+        cache.evict()
+    assert len(os.listdir(cache.blobs_path)) == 1
+
+
+def test_photo_cache_store_errors_are_logged(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_size=1024)
+    with patch("avbot.photo_cache.os.symlink", side_effect=OSError(28, "")):
+        cache.store("https://img/1.jpg", b"photo")
+    assert cache.open("https://img/1.jpg") is None
@@ -0,0 +1,48 @@
+import cProfile
+import os
+import pstats
+import time
+from unittest.mock import patch
+
+from avbot import profiling
+
+
+def busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_profiles_are_aggregated_and_rotated(tmp_path):
+    store = profiling.ProfileStore(str(tmp_path), flush_samples=2, keep=1)
+    for _ in range(4):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        busy(0.001)
+        profiler.disable()
+        store.add("avbot.tasks.an_paginated_search", profiler)
+
+    files = os.listdir(tmp_path / "avbot.tasks.an_paginated_search")
+    assert len(files) == 1
+    stats = pstats.Stats(
+        str(tmp_path / "avbot.tasks.an_paginated_search" / files[0]))
+    assert any(func[2] == "busy" for func in stats.stats)
+
+
+def test_sampler_writes_collapsed_stacks(tmp_path):
+    store = profiling.ProfileStore(str(tmp_path), flush_samples=1, keep=5)
+    sampler = profiling.StackSampler(0.001)
+    sampler.enable()
+    busy(0.05)
+    sampler.disable()
+    store.add("on_search_query", sampler)
+
+    [filename] = os.listdir(tmp_path / "on_search_query")
+    assert filename.endswith(".folded")
+    with open(tmp_path / "on_search_query" / filename) as f:
+        assert "busy (test_profiling.py" in f.read()
+
+
+@patch("avbot.profiling.settings.PROFILE_SAMPLE_RATE", 0)
+def test_not_sampled_calls_are_not_profiled():
+    assert profiling.start() is None
@@ -1,4 +1,6 @@
 from avbot.cmd import ru, su, ge, kz, uz, ua
+from avbot.plate_formats import PLATE_FORMATS, find_plate_formats, \
+    get_plate_format_by_type
 
 
 def test_validate_ru_car_license_plates():
@@ -90,3 +92,23 @@ def test_validate_ua_regular_plates_2004():
     assert ua.UaPrivateVehiclesRequest.validate("ka1234hc")
     assert not ua.UaPrivateVehiclesRequest.validate("ka1234hca")
     assert not ua.UaPrivateVehiclesRequest.validate("kaa124hc")
+
+
+def test_find_plate_formats_matches_each_format_validate():
+    queries = [
+        "а123аа777", "4197хк47", "ru37", "ааа777", "ж8028НІ",
+        "aa-123-aa", "ka1234hc", "ny abc", "ny abcd", "ru1991", "hello",
+    ]
+    for query in queries:
+        expected = [
+            (plate.validate(query), country_code, plate)
+            for country_code, plates in PLATE_FORMATS.items()
+            for plate in plates
+            if plate.validate(query)
+        ]
+        assert find_plate_formats(query) == expected
+
+
+def test_get_plate_format_by_type():
+    assert get_plate_format_by_type("ru-moto") is ru.RuMotorcyclesRequest
+    assert get_plate_format_by_type("unknown") is None
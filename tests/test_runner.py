@@ -0,0 +1,94 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from celery import Celery
+from celery.signals import task_prerun
+from requests.exceptions import RequestException
+
+from avbot.runner import LocalRunner, get_retry_delay
+
+
+def make_task(side_effect):
+    return MagicMock(
+        side_effect=side_effect,
+        autoretry_for=(RequestException, ),
+        retry_kwargs={"max_retries": 2},
+        retry_backoff=False,
+        default_retry_delay=0,
+        soft_time_limit=5,
+    )
+
+
+def test_retry_delay_follows_task_options():
+    task = make_task(None)
+    assert get_retry_delay(task, RequestException(), 0) == 0
+    assert get_retry_delay(task, RequestException(), 2) is None
+    assert get_retry_delay(task, ValueError(), 0) is None
+
+
+def test_task_is_retried_until_success():
+    task = make_task([RequestException(), "result"])
+    runner = LocalRunner(2)
+
+    assert runner.submit(task, (1, 2)).result(timeout=5) == "result"
+    assert task.call_count == 2
+    task.on_failure.assert_not_called()
+
+
+def test_failure_handler_is_called_when_retries_are_exhausted():
+    task = make_task(RequestException())
+    runner = LocalRunner(2)
+
+    assert runner.submit(task, (1, 2)).result(timeout=5) is None
+    assert task.call_count == 3
+    task.on_failure.assert_called_once()
+
+
+def test_timed_out_task_keeps_its_thread_slot():
+    hung = make_task(lambda *args: time.sleep(0.5))
+    hung.soft_time_limit = 0.1
+    task = make_task(["result"])
+    task.soft_time_limit = 0.3
+    runner = LocalRunner(1)
+
+    first = runner.submit(hung)
+    time.sleep(0.05)
+    second = runner.submit(task)
+
+    assert first.result(timeout=5) is None
+    hung.on_failure.assert_called_once()
+    # waiting for the hung thread doesn't count against the time limit
+    assert second.result(timeout=5) == "result"
+
+
+def test_task_request_has_published_at():
+    app = Celery("test", set_as_current=False)
+    published = []
+
+    @app.task
+    def task():
+        return "result"
+
+    def on_prerun(task=None, **kwargs):
+        published.append(task.request.get("published_at"))
+
+    task_prerun.connect(on_prerun, sender=task, weak=False)
+    try:
+        before = time.time()
+        assert LocalRunner(1).submit(task).result(timeout=5) == "result"
+    finally:
+        task_prerun.disconnect(on_prerun, sender=task)
+
+    assert before <= published[0] <= time.time()
+
+
+def test_semaphore_is_released_when_submit_fails():
+    runner = LocalRunner(1)
+    runner.submit(make_task(["result"])).result(timeout=5)
+
+    with patch.object(runner, "_in_executor", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            runner.submit(make_task(None)).result(timeout=5)
+
+    assert runner.submit(make_task(["result"])).result(timeout=1) == "result"
@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from avbot.sender import Sender
+
+
+@patch("avbot.sender.TokenBucket")
+def test_flood_control_error_is_retried(mockbucket):
+    mockbucket.return_value.take.return_value = 0
+    bot = MagicMock()
+    bot.send_message.side_effect = [RetryAfter(0), "message"]
+    sender = Sender(bot)
+
+    sent = sender.send_message(1, "text")
+
+    assert sent.result(timeout=5) == "message"
+    assert bot.send_message.call_count == 2
+    assert sender.flush(timeout=5)
+
+
+@patch("avbot.sender.TokenBucket")
+def test_calls_wait_for_chat_token(mockbucket):
+    mockbucket.return_value.take.side_effect = [0.05, 0]
+    bot = MagicMock()
+    sender = Sender(bot)
+
+    sender.send_message(1, "text").result(timeout=5)
+
+    bot.send_message.assert_called_once_with(1, "text")
+    # both limits are checked before any token is taken
+    mockbucket.return_value.take.assert_called_with(sender.bucket)
+    assert mockbucket.return_value.take.call_count == 2
+
+
+@patch("avbot.sender.TokenBucket")
+def test_errors_are_set_on_future(mockbucket):
+    mockbucket.return_value.take.return_value = 0
+    bot = MagicMock()
+    bot.send_message.side_effect = BadRequest("Chat not found")
+    sender = Sender(bot)
+
+    with pytest.raises(BadRequest):
+        sender.send_message(1, "text").result(timeout=5)
@@ -0,0 +1,120 @@
+from concurrent.futures import Future
+from io import BytesIO
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import telegram
+from prometheus_client import REGISTRY
+
+from avbot import avtonomer, tasks
+
+
+@patch("avbot.tasks.settings.PHOTO_STORAGE_CHAT_ID", "-100")
+@patch("avbot.tasks.sender")
+@patch("avbot.tasks.avtonomer.async_load_photo", new_callable=AsyncMock)
+@patch("avbot.tasks.cache")
+def test_prefetch_photos_caches_uploaded_file_ids(
+    mockcache, mockload, mocksender
+):
+    mockcache.get_many.return_value = ["cached", None, None]
+    mockload.side_effect = [BytesIO(b"1"), None]
+    message = MagicMock()
+    message.photo[-1].file_id = "file-id"
+    mocksender.send_photo.return_value.result.return_value = message
+
+    tasks.prefetch_photos(["cached.jpg", "1.jpg", "404.jpg"])
+
+    assert mockload.await_count == 2
+    mocksender.send_photo.assert_called_once()
+    mockcache.set_many.assert_called_once_with(
+        {tasks.get_photo_cache_key("1.jpg"): "file-id"},
+        tasks.PHOTO_FILE_ID_TTL,
+    )
+
+
+@patch("avbot.tasks.settings.EMPTY_PLATES_RECHECK_RATE", 0)
+@patch("avbot.tasks.bloom.get_negative_index")
+def test_search_plate_skips_known_empty_plates(mockindex):
+    mockindex.return_value = {"a123aa77"}
+    plate_format = MagicMock(num_type="ru")
+
+    result = tasks.search_plate(plate_format, "a123aa77")
+
+    assert result.total_results == 0
+    plate_format.search.assert_not_called()
+
+
+@patch("avbot.tasks.bloom.get_negative_index")
+def test_search_plate_remembers_empty_plates(mockindex):
+    plate_format = MagicMock(num_type="ru")
+    plate_format.search.return_value = avtonomer.AvSearchResult(0, [])
+
+    tasks.search_plate(plate_format, "a123aa77")
+
+    mockindex.return_value.add.assert_called_once_with("a123aa77")
+
+
+@patch("avbot.tasks.settings.EMPTY_PLATES_RECHECK_RATE", 1)
+@patch("avbot.tasks.bloom.get_negative_index")
+def test_search_plate_forgets_plates_found_on_recheck(mockindex):
+    mockindex.return_value = MagicMock()
+    mockindex.return_value.__contains__.return_value = True
+    plate_format = MagicMock(num_type="ru")
+    plate_format.search.return_value = avtonomer.AvSearchResult(1, [])
+
+    tasks.search_plate(plate_format, "a123aa77")
+
+    mockindex.return_value.discard.assert_called_once_with("a123aa77")
+
+
+def test_page_switching_is_routed_to_interactive_queue():
+    name = tasks.an_paginated_search.name
+    route = tasks.route_task(name, (1, 2, 3), {"page": 1, "edit": True}, {})
+    assert route == {"queue": tasks.QUEUE_INTERACTIVE, "priority": 0}
+    route = tasks.route_task(name, (1, 2, 3), {"language": "ru"}, {})
+    assert route["queue"] == tasks.QUEUE_SEARCH
+
+
+def test_empty_search_results_are_cached_shortly():
+    empty = avtonomer.AvSearchResult(0, [])
+    found = avtonomer.AvSearchResult(1, [])
+    assert tasks.get_search_result_ttl(empty) == (
+        tasks.settings.SEARCH_EMPTY_RESULT_TTL,
+        tasks.settings.SEARCH_EMPTY_RESULT_TTL,
+    )
+    assert tasks.get_search_result_ttl(found)[0] == \
+        tasks.settings.SEARCH_RESULT_STALE_TTL
+
+
+@patch("avbot.tasks.logger")
+def test_failures_of_replies_not_waited_for_are_logged(mocklogger):
+    future = Future()
+    tasks.log_failure(future)
+    future.set_exception(telegram.error.BadRequest("Chat not found"))
+    mocklogger.error.assert_called_once()
+
+
+@tasks.app.task(bind=True, max_retries=1)
+def retried_once(self):
+    if not self.request.retries:
+        raise self.retry(countdown=0)
+    return "done"
+
+
+@patch("avbot.tracing._save")
+@patch("avbot.tasks.db")
+def test_task_run_updates_metrics(mockdb, mocksave):
+    name = retried_once.name
+
+    def sample(metric, **labels):
+        return REGISTRY.get_sample_value(
+            metric, {"task": name, **labels}) or 0
+
+    seconds_before = sample("avbot_task_seconds_count", state="SUCCESS")
+    retries_before = sample("avbot_task_retries_total")
+
+    assert retried_once.apply().get() == "done"
+
+    assert sample("avbot_task_seconds_count", state="SUCCESS") == \
+        seconds_before + 1
+    assert sample("avbot_task_retries_total") == retries_before + 1
+    assert not tasks._task_started_at
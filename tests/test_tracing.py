@@ -0,0 +1,40 @@
+import json
+from unittest.mock import patch
+
+from avbot import tracing
+
+
+@patch("avbot.tracing._redis")
+def test_spans_are_saved_at_the_end_of_trace(mockredis):
+    correlation_id = tracing.start_trace()
+    with tracing.span("validate"):
+        pass
+    tracing.link_search_query(42)
+    mockredis.pipeline.assert_not_called()
+
+    tracing.end_trace()
+
+    pipe = mockredis.pipeline.return_value
+    key, item = pipe.rpush.call_args_list[0].args
+    assert key == f"trace:{correlation_id}"
+    assert json.loads(item)["stage"] == "validate"
+    pipe.rpush.assert_any_call("trace:search_query:42", correlation_id)
+    assert tracing.get_correlation_id() is None
+
+
+@patch("avbot.tracing._redis")
+def test_spans_without_trace_are_dropped(mockredis):
+    tracing.add_span("cache", 0.001)
+    mockredis.pipeline.assert_not_called()
+
+
+@patch("avbot.tracing._redis")
+def test_get_traces(mockredis):
+    mockredis.lrange.return_value = [b"abc"]
+    mockredis.pipeline.return_value.execute.return_value = [[
+        json.dumps({"stage": "task", "at": 2.0, "ms": 900}),
+        json.dumps({"stage": "queue_wait", "at": 1.0, "ms": 5}),
+    ]]
+    [(correlation_id, spans)] = tracing.get_traces(42)
+    assert correlation_id == "abc"
+    assert [span["stage"] for span in spans] == ["queue_wait", "task"]
@@ -0,0 +1,67 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from avbot import metrics, upstream
+
+
+@patch("avbot.upstream._redis")
+def test_breaker_opens_after_threshold_failures(mockredis):
+    breaker = upstream.CircuitBreaker("an", 3, 30, 60)
+    pipe = mockredis.pipeline.return_value
+    pipe.execute.side_effect = [[2, True, 0], [3, True, 0], None]
+
+    breaker.record_failure()
+    pipe.setex.assert_not_called()
+    breaker.record_failure()
+    pipe.setex.assert_called_once_with("upstream:an:open", 60, 1)
+
+
+@patch("avbot.upstream._redis")
+def test_half_open_breaker_lets_one_probe_through(mockredis):
+    breaker = upstream.CircuitBreaker("an", 3, 30, 60)
+    mockredis.pipeline.return_value.execute.return_value = [0, 1]
+    mockredis.set.side_effect = [True, None]
+
+    assert breaker.get_state() == breaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_open_upstream_fails_fast():
+    guarded = upstream.Upstream("an", 5, 10)
+    guarded.breaker = MagicMock()
+    guarded.breaker.allow.return_value = False
+    session = MagicMock()
+
+    with pytest.raises(upstream.UpstreamUnavailable):
+        guarded.get(session, "https://platesmania.com")
+    session.get.assert_not_called()
+
+
+@patch("avbot.upstream._redis")
+def test_token_is_taken_from_all_buckets_at_once(mockredis):
+    chat = upstream.TokenBucket("telegram:1", 1, 3)
+    total = upstream.TokenBucket("telegram", 25, 30)
+    script = mockredis.register_script.return_value
+    script.return_value = b"0.5"
+
+    assert chat.take(total) == 0.5
+    script.assert_called_once_with(
+        keys=["upstream:telegram:1:tokens", "upstream:telegram:tokens"],
+        args=[1, 3, 25, 30],
+    )
+
+
+@patch("avbot.upstream._redis")
+def test_breaker_state_is_exported(mockredis):
+    guarded = upstream.Upstream("test", 5, 10)
+    mockredis.pipeline.return_value.execute.return_value = [1, 1]
+
+    families = list(metrics.BreakerStateCollector().collect())
+
+    samples = {
+        sample.labels["upstream"]: sample.value
+        for sample in families[0].samples
+    }
+    assert samples[guarded.name] == metrics.BREAKER_STATES["open"]